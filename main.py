@@ -1,12 +1,11 @@
+import asyncio
 import logging
 import os
 import sys
-import json
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
 
-from src.fetcher import SensorTowerFetcher
-from src.analyzer import VideoAnalyzer
-from src.renderer import ReportRenderer
+from src import jsonio
 
 # Configure logging
 logging.basicConfig(
@@ -15,7 +14,104 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def main():
+RANKED_NETWORKS = ('applovin', 'facebook', 'youtube')
+# Compact per-week {ad_id: rank/share} index, read by the following week instead of the full raw archive
+RANK_INDEX_FILENAME = "ranks.msgpack"
+
+def find_previous_week_archive(year: int, week: int, archive_root: str = "archive") -> Optional[str]:
+    """
+    Returns the archive directory name of the ISO week before (year, week).
+    The immediately preceding week is probed directly; the directory scan only
+    runs when that week was skipped, and then picks the most recent older archive.
+    """
+    prev_year, prev_week, _ = (date.fromisocalendar(year, week, 1) - timedelta(days=7)).isocalendar()
+    candidate = f"{prev_year}_W{prev_week:02d}"
+    if os.path.isdir(os.path.join(archive_root, candidate)):
+        return candidate
+
+    if not os.path.isdir(archive_root):
+        return None
+    current = f"{year}_W{week:02d}"
+    older = [
+        d for d in os.listdir(archive_root)
+        if "_W" in d and d < current and os.path.isdir(os.path.join(archive_root, d))
+    ]
+    return max(older) if older else None
+
+def build_rank_index(top_videos_dict: Dict[str, Any]) -> bytes:
+    """Packs the rank/share lookup for this week's videos, stored next to the raw archive."""
+    import msgpack
+    ranks, shares = {}, {}
+    for network in RANKED_NETWORKS:
+        for video in top_videos_dict.get(network, []):
+            ad_id, rank = video.get('ad_id'), video.get('rank')
+            # Same records load_previous_week_stats skips
+            if ad_id is None or rank is None:
+                continue
+            ranks[ad_id] = rank
+            shares[ad_id] = video.get('share')
+    return msgpack.packb({"ranks": ranks, "shares": shares})
+
+async def write_archive_files(files: Dict[str, bytes]) -> None:
+    """Writes pre-serialized archive files concurrently; failures are logged and never abort the workflow."""
+    import aiofiles
+
+    async def write_one(path: str, payload: bytes):
+        try:
+            async with aiofiles.open(path, 'wb') as f:
+                await f.write(payload)
+            logger.info(f"Archived {path}")
+        except Exception as e:
+            logger.warning(f"Failed to archive {path}: {e}")
+
+    await asyncio.gather(*(write_one(path, payload) for path, payload in files.items()))
+
+def load_rank_index(path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Loads ({ad_id: rank}, {ad_id: share}) packed by build_rank_index."""
+    import msgpack
+    with open(path, 'rb') as f:
+        index = msgpack.unpack(f, raw=False)
+    return index.get("ranks", {}), index.get("shares", {})
+
+def load_previous_week_stats(raw_data_path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Streams a week's raw_sensortower_data.json and returns ({ad_id: rank}, {ad_id: share}).
+    Only the ad_id/rank/share scalars are kept; the rest of each record is never built.
+    """
+    import ijson
+
+    item_prefixes = {f"{network}.item" for network in RANKED_NETWORKS}
+    field_prefixes = {
+        f"{network}.item.{field}": field
+        for network in RANKED_NETWORKS
+        for field in ('ad_id', 'rank', 'share')
+    }
+    ranks, shares = {}, {}
+    item = None
+    with open(raw_data_path, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix in field_prefixes:
+                if item is not None:
+                    item[field_prefixes[prefix]] = value
+            elif prefix in item_prefixes:
+                if event == 'start_map':
+                    item = {}
+                elif event == 'end_map':
+                    if item.get('ad_id') is not None and item.get('rank') is not None:
+                        ranks[item['ad_id']] = item['rank']
+                        shares[item['ad_id']] = item.get('share')
+                    item = None
+    return ranks, shares
+
+def export_github_env(report_week: str, report_html_path: str) -> None:
+    """Write outputs to GitHub Actions environment if available."""
+    github_env = os.getenv('GITHUB_ENV')
+    if github_env:
+        with open(github_env, 'a', encoding='utf-8') as f:
+            f.write(f"REPORT_WEEK={report_week}\n")
+            f.write(f"REPORT_HTML_PATH={report_html_path}\n")
+
+async def main():
     logger.info("Starting Weekly US SLG Top50 Video Ads Analysis Workflow...")
     
     # 1. Initialize Components (Using False for actual run, True for testing)
@@ -23,6 +119,9 @@ def main():
     if USE_MOCK:
          logger.warning("Running in MOCK mode. Connecting algorithms but avoiding API costs.")
 
+    step = "Step 1: Initializing"
+    # tenacity is imported past the short-circuit too; until then there is nothing to catch
+    retry_errors: Tuple[type, ...] = ()
     try:
         # Generate week-based archive directory
         year, week, _ = datetime.now().isocalendar()
@@ -36,6 +135,13 @@ def main():
         cache_filepath = os.path.join(archive_dir_path, "analysis_cache.json")
         raw_data_filepath = os.path.join(archive_dir_path, "raw_sensortower_data.json")
         report_filepath = os.path.join(archive_dir_path, f"{archive_dir_name}_weekly_report.html")
+        prev_archive_dir = find_previous_week_archive(year, week)
+
+        # A report for this week already exists (e.g. CI retrigger): nothing to redo unless forced
+        if os.path.exists(report_filepath) and not os.getenv('FORCE_REBUILD'):
+            logger.info(f"Report already generated this week at {report_filepath}. Set FORCE_REBUILD=1 to regenerate.")
+            export_github_env(archive_dir_name, report_filepath)
+            return report_filepath
         
         # Clean up legacy cache file if it exists in root
         legacy_cache = "analysis_cache.json"
@@ -46,13 +152,30 @@ def main():
             except Exception:
                 pass
 
+        # Imported only past the short-circuit: these pull in google-genai, requests and jinja2
+        from tenacity import RetryError
+        retry_errors = (RetryError,)
+        from src.fetcher import SensorTowerFetcher
+        from src.analyzer import SpeculativeAppSummaries, VideoAnalyzer
+        from src.renderer import ReportRenderer
+
         fetcher = SensorTowerFetcher(use_mock=USE_MOCK)
-        analyzer = VideoAnalyzer(use_mock=USE_MOCK, cache_file=cache_filepath)
         renderer = ReportRenderer(template_dir=os.path.join(os.path.dirname(__file__), 'templates'))
         
         # 2. Fetch Data (Step 2)
-        logger.info("Step 2: Fetching Video Data...")
-        top_videos_dict = fetcher.fetch_top_50_slg_videos(cache_file=raw_data_filepath)
+        # The analyzer's cache load is independent of the Sensor Tower round-trips, so both run side by side
+        step = "Step 2: Fetching Video Data"
+        logger.info(f"{step}...")
+        top_videos_dict, analyzer = await asyncio.gather(
+            asyncio.to_thread(fetcher.fetch_top_50_slg_videos, cache_file=raw_data_filepath),
+            # Last week's analyses are reused for creatives that are still in the top lists
+            asyncio.to_thread(
+                VideoAnalyzer,
+                use_mock=USE_MOCK,
+                cache_file=cache_filepath,
+                seed_cache_file=os.path.join("archive", prev_archive_dir, "analysis_cache.json") if prev_archive_dir else None,
+            ),
+        )
         if not top_videos_dict or (not top_videos_dict.get('applovin') and not top_videos_dict.get('facebook') and not top_videos_dict.get('youtube')):
             logger.error("No videos retrieved. Exiting workflow.")
             sys.exit(1)
@@ -65,48 +188,32 @@ def main():
         for app in top_videos_dict.get('monitored_apps', []):
             app['company'] = fetcher._get_company(app.get('name', ''))
 
-        # Archive the raw SensorTower data
-        try:
-            with open(raw_data_filepath, 'w', encoding='utf-8') as f:
-                json.dump(top_videos_dict, f, ensure_ascii=False, indent=2)
-            logger.info(f"Raw data archived to {raw_data_filepath}")
-        except Exception as e:
-            logger.warning(f"Failed to archive raw data to {raw_data_filepath}: {e}")
+        # Archive the raw SensorTower data in the background while videos are analyzed.
+        # Serialize now, before Step 3 starts mutating the video dicts.
+        archive_task = asyncio.create_task(write_archive_files({
+            raw_data_filepath: jsonio.dumps(top_videos_dict),
+            os.path.join(archive_dir_path, RANK_INDEX_FILENAME): build_rank_index(top_videos_dict),
+        }))
             
         # 3. Analyze Videos (Step 3) 
-        logger.info("Step 3: Analyzing Videos structurally via GenAI and Comparing Ranks...")
+        step = "Step 3: Analyzing Videos structurally via GenAI and Comparing Ranks"
+        logger.info(f"{step}...")
         
-        # Helper: Extract week number and sort descending to find previous week
-        def get_all_week_archives():
-            if not os.path.exists("archive"):
-                return []
-            dirs = [d for d in os.listdir("archive") if os.path.isdir(os.path.join("archive", d)) and "_W" in d]
-            dirs.sort(reverse=True) # e.g. ["2024_W45", "2024_W44", "2023_W52"]
-            return dirs
-            
         previous_week_ranks = {}
         previous_week_shares = {}
-        all_archives = get_all_week_archives()
-        # Find the most recent archive that is NOT the current week
-        prev_archive_dir = None
-        for d in all_archives:
-            if d != archive_dir_name:
-                prev_archive_dir = d
-                break
 
         if prev_archive_dir:
             logger.info(f"Cross-referencing ranks with previous week: {prev_archive_dir}")
+            prev_index_path = os.path.join("archive", prev_archive_dir, RANK_INDEX_FILENAME)
             prev_data_path = os.path.join("archive", prev_archive_dir, "raw_sensortower_data.json")
-            if os.path.exists(prev_data_path):
-                try:
-                    with open(prev_data_path, 'r', encoding='utf-8') as f:
-                        prev_data = json.load(f)
-                        for network in ['applovin', 'facebook', 'youtube']:
-                            for item in prev_data.get(network, []):
-                                previous_week_ranks[item['ad_id']] = item['rank']
-                                previous_week_shares[item['ad_id']] = item.get('share')
-                except Exception as e:
-                    logger.warning(f"Failed to load previous week data: {e}")
+            try:
+                if os.path.exists(prev_index_path):
+                    previous_week_ranks, previous_week_shares = load_rank_index(prev_index_path)
+                elif os.path.exists(prev_data_path):
+                    # Archives written before the rank index existed
+                    previous_week_ranks, previous_week_shares = load_previous_week_stats(prev_data_path)
+            except Exception as e:
+                logger.warning(f"Failed to load previous week data: {e}")
         else:
             logger.info("No previous week archive found for rank comparison.")
 
@@ -152,34 +259,44 @@ def main():
                 video['share_change'] = None
                 video['share_change_dir'] = None
         
-        applovin_videos = top_videos_dict.get('applovin', [])
-        for v in applovin_videos: 
-            v['channel'] = 'applovin'
-            calculate_rank_change(v)
-                 
-        facebook_videos = top_videos_dict.get('facebook', [])
-        for v in facebook_videos: 
-            v['channel'] = 'facebook'
-            calculate_rank_change(v)
-        
-        youtube_videos = top_videos_dict.get('youtube', [])
-        for v in youtube_videos: 
-            v['channel'] = 'youtube'
-            calculate_rank_change(v)
-        
-        all_videos = applovin_videos + facebook_videos + youtube_videos
+        # Single pass per channel (videos arrive tagged by the fetcher): diff ranks and reserve the result slot
+        all_videos = []
+        result_slots = []
+        channel_results = {}
+        for channel in RANKED_NETWORKS:
+            channel_videos = top_videos_dict.get(channel, [])
+            channel_results[channel] = [None] * len(channel_videos)
+            for position, v in enumerate(channel_videos):
+                calculate_rank_change(v)
+                all_videos.append(v)
+                result_slots.append((channel, position))
         logger.info(f"--- Analyzing All {len(all_videos)} Videos Concurrently ---")
-        
-        # Max concurrency for pay-as-you-go. Run all concurrently!
-        analyzed_all = analyzer.analyze_videos_concurrently(all_videos, max_workers=20)
-        
-        analyzed_applovin = [v for v in analyzed_all if v.get('channel') == 'applovin']
-        analyzed_facebook = [v for v in analyzed_all if v.get('channel') == 'facebook']
-        analyzed_youtube = [v for v in analyzed_all if v.get('channel') == 'youtube']
+
+        # Each app's strategy summary (Step 4) starts as soon as its own videos are done
+        summaries = SpeculativeAppSummaries(analyzer, all_videos)
+
+        def place_result(index: int, result: Dict[str, Any]):
+            channel, position = result_slots[index]
+            channel_results[channel][position] = result
+            summaries.add(index, result)
+
+        if os.getenv('USE_BATCH_API'):
+            # Gemini Batch Mode: half price, results within minutes to hours
+            await analyzer.analyze_videos_batch_async(all_videos, on_result=place_result)
+        else:
+            # Max concurrency for pay-as-you-go. Run all concurrently!
+            await analyzer.analyze_videos_async(all_videos, on_result=place_result)
+        # Fold this run's cache journal into the archived analysis_cache.json
+        analyzer.close()
+        analyzed_applovin = channel_results['applovin']
+        analyzed_facebook = channel_results['facebook']
+        analyzed_youtube = channel_results['youtube']
+        await archive_task
                  
         # 4. Strategic Summary (Step 4)
-        logger.info("Step 4: Generating Strategic Summary per App...")
-        raw_app_summaries = analyzer.generate_per_app_strategy_summaries(analyzed_all)
+        step = "Step 4: Generating Strategic Summary per App"
+        logger.info(f"{step}...")
+        raw_app_summaries = await summaries.collect()
         
         # Order app_summaries to match the order of monitored_apps to fix tab activation bug
         monitored_apps_list = top_videos_dict.get('monitored_apps', [])
@@ -193,19 +310,27 @@ def main():
                 ordered_app_summaries[app_name] = summary
                 
         # 5. Render HTML (Step 5)
-        logger.info("Step 5: Synthesizing HTML Report...")
-        output_file_path = renderer.render(
+        step = "Step 5: Synthesizing HTML Report"
+        logger.info(f"{step}...")
+        # Jinja rendering runs in a worker thread; the GitHub env only needs the (already known)
+        # report path, so it is exported meanwhile. The redirect waits for a successful render.
+        render_task = asyncio.create_task(asyncio.to_thread(
+            renderer.render,
             app_summaries=ordered_app_summaries,
             applovin_items=analyzed_applovin,
             facebook_items=analyzed_facebook,
             youtube_items=analyzed_youtube,
             monitored_apps=monitored_apps_list,
             output_path=report_filepath
-        )
+        ))
+        
+        export_github_env(archive_dir_name, report_filepath)
+        
+        output_file_path = await render_task
         
         # Generate index.html for redirect
         index_html_path = "index.html"
-        redirect_url = output_file_path.replace('\\', '/')
+        redirect_url = report_filepath.replace('\\', '/')
         index_content = f"""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
@@ -223,19 +348,16 @@ def main():
             logger.info(f"Generated root index.html to redirect to {redirect_url}")
         except Exception as e:
             logger.warning(f"Failed to generate index.html: {e}")
-        
-        # Write outputs to GitHub Actions environment if available
-        github_env = os.getenv('GITHUB_ENV')
-        if github_env:
-            with open(github_env, 'a', encoding='utf-8') as f:
-                f.write(f"REPORT_WEEK={archive_dir_name}\n")
-                f.write(f"REPORT_HTML_PATH={output_file_path}\n")
-        
+
         logger.info(f"Workflow Complete! Artifact generated at: {output_file_path}")
+        return output_file_path
 
+    except retry_errors as e:
+        logger.error(f"{step} failed after exhausting retries: {e.last_attempt.exception()}")
+        sys.exit(1)
     except Exception as e:
         logger.exception(f"An error occurred during workflow execution: {e}")
         sys.exit(1)
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
@@ -1,20 +1,120 @@
+import asyncio
+import contextlib
+import io
 import logging
 import json
 import os
-import time
-import requests
-import tempfile
+import random
+import re
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Any, Optional
+import time
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from cachetools import TTLCache
+from tenacity import before_sleep_log, retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 from google import genai
 from google.genai import types
 from google.genai.errors import APIError
-from pydantic import BaseModel, Field
-from src.config import GEMINI_API_KEY
+from pydantic import BaseModel, Field, TypeAdapter
+from src import jsonio
+from src.config import GEMINI_API_KEY, GEMINI_BATCH_MAX_WAIT, GEMINI_RPM, GEMINI_RPS, GEMINI_TPM, GEMINI_TARGET_LATENCY, VIDEO_DOWNLOAD_VERIFY_TLS
+from src.ratelimit import AIMDController, SlidingWindowLimiter, TokenBucket, parse_number
 
 logger = logging.getLogger(__name__)
 
+# HTTP statuses worth retrying when downloading a video from the ad CDN
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Bounds on the on-disk analysis cache: entries older than the TTL are dropped on load,
+# and only the most recently analyzed CACHE_MAX_ENTRIES are kept
+CACHE_MAX_ENTRIES = 512
+CACHE_TTL_SECONDS = 14 * 86400
+# Analyses carried over from the previous week's cache. Slightly over 7 days so the
+# weekly cron finds last week's run despite schedule jitter and manual reruns.
+AD_REUSE_WINDOW_SECONDS = 8 * 86400
+
+# Rough Gemini token cost of one second of video at default media resolution (frames + audio)
+VIDEO_TOKENS_PER_SECOND = 300
+
+# Gemini Batch Mode polling
+BATCH_POLL_INITIAL_SECONDS = 10
+BATCH_POLL_MAX_SECONDS = 300
+BATCH_MAX_WAIT_SECONDS = GEMINI_BATCH_MAX_WAIT
+BATCH_TERMINAL_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+# Backoff for Gemini generate calls: min(cap, base * 2**attempt), stretched by up to +50% jitter
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+RETRY_JITTER = 0.5
+# Rate-limit retries get their own, larger budget than transient server errors
+RATE_LIMIT_MAX_RETRIES = 5
+
+# Analysis fields packed into the per-app summary prompt, with their labels
+SUMMARY_FIELDS = ('hook_design', 'emotional_appeal', 'content_structure', 'wow_factor', 'copywriting_features')
+SUMMARY_LABELS = ('钩子', '情绪', '结构', '爽点', '文案')
+
+# Per-app strategy summaries generated at once
+SUMMARY_MAX_CONCURRENCY = 10
+
+# Per-stage bounds of the video pipeline (download -> upload -> poll -> generate).
+# Polling holds no slot; generation is gated by the adaptive AIMD controller.
+DOWNLOAD_CONCURRENCY = 8
+UPLOAD_CONCURRENCY = 4
+# Read size for video downloads: each read drains up to 1 MiB already buffered by aiohttp
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+# Hard cap on a single ad video; SLG ads are typically well under 15 MB
+MAX_VIDEO_BYTES = 50 << 20
+
+# Videos up to VIDEO_GROUP_MAX_SECONDS long are analyzed VIDEO_GROUP_SIZE at a time in one
+# generate call; longer videos, or those of unknown length, keep one call each
+VIDEO_GROUP_SIZE = 4
+VIDEO_GROUP_MAX_SECONDS = 45
+
+# Analysis dimensions and script few-shot shared by the single-video and grouped prompts
+VIDEO_ANALYSIS_INSTRUCTIONS = """
+        请严格按照以下 5 个维度分析该视频的内容，并以纯 JSON 格式输出（内容必须全部是简体中文）。
+        【极其重要：每个维度的分析结果极其精简，绝不能超过 100 个中文字！】
+        
+        1. hook_design (前 3 秒钩子设计：它是如何抓人眼球的？限100字内)
+        2. emotional_appeal (情绪导向：它唤起了什么情绪？如焦虑、解压、挫败感等。限100字内)
+        3. content_structure (核心内容结构：剧情的起承转合或游戏玩法的展示顺序是什么？限100字内)
+        4. wow_factor (爆点/爽点要素：视频中最核心的视觉奇观或最令人满足的瞬间是什么？限100字内)
+        5. copywriting_features (文案特征与 CTA：分析屏幕文字、配音台词以及转化按钮的特点。限50字内)
+        6. video_script (视频脚本拆解：作为附加输出，将视频拆解为多个镜头，提取角色、布景、画面描述等，并必须附带准确的开始秒数和结束秒数。详见返回的 JSON 结构要求。)
+        
+        【关于 video_script 拆解的 Few-Shot 标准范例参考】：
+        "validation_goal": "经营危机感/紧迫感作为hook/贯彻全程对点击/成本的影响",
+        "overall_process": "经营冲突->解决冲突->新经营冲突->解决冲突->外部冲突->招募英雄->扩建展示",
+        "shots": [
+            {
+                "shot_number": 1,
+                "start_timestamp": 0,
+                "end_timestamp": 3,
+                "Character": "警察，女囚犯",
+                "weapon": "手枪，AK47",
+                "scene": "整体场景做出室内感+中世纪风格，室外为草地+积雪",
+                "camera": "斜45度上帝视角",
+                "detailed_action": "开场酒馆门口聚集成群的顾客全身满是污泥，人群上面有两种emoji（生气冒火/不耐烦）",
+                "sound_effect": "人群嘈杂声、生气发火声"
+            },
+            {
+                "shot_number": 2,
+                "start_timestamp": 3,
+                "end_timestamp": 8,
+                "Character": "警察，女囚犯",
+                "weapon": "手枪，AK47",
+                "scene": "超大木质浴盆",
+                "camera": "斜45度上帝视角",
+                "detailed_action": "镜头向右上平移回到“主角居中”位置，主角向左下移动，抱起两名顾客走到浴池边（超大木质浴盆），蓄力0.3s后将客人扔进水中；客人进入水中前，湖面右侧耐心值UI持续上涨，在客人入水前，耐心值（生气）临近顶点",
+                "sound_effect": "无"
+            }
+        ]
+        请务必参考并严格遵守这一分镜拆解的颗粒度和精简结构！特别是每个分镜必须要有与之对应的视频起始与结束秒数（整数），不要留空！
+        """
+
 # --- Pydantic Models for Structured Output ---
 class ScriptShot(BaseModel):
     shot_number: int  # 镜号
@@ -50,17 +150,150 @@ class StrategySummaryResult(BaseModel):
     competitor_tactics: str
     actionable_advice: str
 
+# Validators for the raw-text fallback when the SDK returns no parsed object: parse and
+# validate the JSON in one pass so the fallback yields the same shape as `parsed`
+_VIDEO_ADAPTER = TypeAdapter(VideoAnalysisResult)
+_SUMMARY_ADAPTER = TypeAdapter(PerAppSummaryResult)
+_VIDEO_LIST_ADAPTER = TypeAdapter(list[VideoAnalysisResult])
+
+
+def _response_headers(source: Any) -> Optional[Dict[str, str]]:
+    """Extracts HTTP headers from an SDK response (sdk_http_response) or an APIError (response)."""
+    http_response = getattr(source, 'sdk_http_response', None) or getattr(source, 'response', None)
+    headers = getattr(http_response, 'headers', None)
+    return dict(headers) if headers else None
+
+def _is_throttling_error(error: BaseException) -> bool:
+    """True for 429 and 5xx responses, which should make the AIMD controller back off."""
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    return any(marker in str(error) for marker in ("429", "500", "503"))
+
+class ErrorClass(Enum):
+    """How _call_api_with_retry reacts to a failed Gemini call."""
+    TRANSIENT = "transient"    # 5xx / network: back off and retry the same model
+    RATE_LIMIT = "rate_limit"  # 429: honor the provider's retry delay, separate budget
+    NOT_FOUND = "not_found"    # 404: move to the next model right away
+    FATAL = "fatal"            # anything else: no retry on this model
+
+def _classify_error(error: BaseException) -> ErrorClass:
+    code = getattr(error, 'code', None)
+    if not isinstance(code, int):
+        text = str(error)
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError, TimeoutError)):
+            return ErrorClass.TRANSIENT
+        if "404" in text or "not found" in text.lower():
+            return ErrorClass.NOT_FOUND
+        if "429" in text:
+            return ErrorClass.RATE_LIMIT
+        if "500" in text or "503" in text:
+            return ErrorClass.TRANSIENT
+        return ErrorClass.FATAL
+    if code == 404:
+        return ErrorClass.NOT_FOUND
+    if code == 429:
+        return ErrorClass.RATE_LIMIT
+    if code >= 500 or code == 408:
+        return ErrorClass.TRANSIENT
+    return ErrorClass.FATAL
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Server-requested delay from a Retry-After header or a google.rpc.RetryInfo error detail."""
+    headers = {k.lower(): v for k, v in (_response_headers(error) or {}).items()}
+    delay = parse_number(headers.get("retry-after"))
+    if delay is not None:
+        return delay
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        for detail in (details.get('error') or {}).get('details') or []:
+            if isinstance(detail, dict) and str(detail.get('@type', '')).endswith('RetryInfo'):
+                return parse_number(detail.get('retryDelay'))
+    return None
+
+def _backoff_delay(attempt: int) -> float:
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)) * (1 + RETRY_JITTER * random.random())
+
+def _is_transient_download_error(error: BaseException) -> bool:
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status in TRANSIENT_STATUS_CODES
+    return isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
+
+def _archive_week_end(path: str) -> Optional[float]:
+    """
+    End (UTC) of the ISO week a cache file was archived under, e.g. archive/2026_W15/analysis_cache.json,
+    or None outside a week directory. The weekly run happens at the end of its week, so this dates
+    legacy entries without cached_at far better than the file mtime, which is just checkout time.
+    """
+    match = re.fullmatch(r"(\d{4})_W(\d{2})", os.path.basename(os.path.dirname(os.path.abspath(path))))
+    if not match:
+        return None
+    try:
+        week_start = datetime.fromisocalendar(int(match.group(1)), int(match.group(2)), 1)
+    except ValueError:
+        return None
+    return (week_start.replace(tzinfo=timezone.utc) + timedelta(days=7)).timestamp()
+
+def _video_session() -> aiohttp.ClientSession:
+    """Shared connection pool for ad video downloads; TLS verification follows VIDEO_DOWNLOAD_VERIFY_TLS."""
+    connector = aiohttp.TCPConnector(limit=64, ssl=VIDEO_DOWNLOAD_VERIFY_TLS)
+    return aiohttp.ClientSession(connector=connector)
+
+def _compact_analysis(analysis: Dict[str, Any]) -> str:
+    """One-line '钩子:... 情绪:... ...' digest of a video analysis for the summary prompt."""
+    return " ".join(f"{label}:{analysis.get(field, '')}" for field, label in zip(SUMMARY_FIELDS, SUMMARY_LABELS))
+
+def _collect_app_summaries(outcomes: List[Any]) -> Dict[str, Dict[str, Any]]:
+    """Turns gathered (app_name, summary) outcomes into a dict, logging tasks that crashed."""
+    app_summaries = {}
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            logger.error(f"Failed to generate summary task: {outcome}")
+            continue
+        app_name, summary = outcome
+        app_summaries[app_name] = summary
+    return app_summaries
+
 
 class VideoAnalyzer:
     """Handles interaction with Google GenAI for video analysis and summarization."""
     
-    def __init__(self, use_mock: bool = False, cache_file: str = "analysis_cache.json"):
+    def __init__(self, use_mock: bool = False, cache_file: str = "analysis_cache.json", limiter: Optional[SlidingWindowLimiter] = None, controller: Optional[AIMDController] = None, seed_cache_file: Optional[str] = None, bucket: Optional[TokenBucket] = None):
         self.use_mock = use_mock
         self.cache_file = cache_file
-        self.analysis_cache = self._load_cache()
+        # A previous run's cache (e.g. last week's archive) whose recent analyses may be reused
+        self.seed_cache_file = seed_cache_file
+        # Append-only log of entries added since the last compaction into cache_file
+        self.cache_journal = os.path.splitext(cache_file)[0] + ".jsonl"
+        self._journal_fd: Optional[int] = None
+        self.limiter = limiter or SlidingWindowLimiter(rpm=GEMINI_RPM, tpm=GEMINI_TPM)
+        self.bucket = bucket or TokenBucket(rate=GEMINI_RPS or GEMINI_RPM / 60)
+        self.controller = controller or AIMDController(c_min=2, c_max=64, l_target=GEMINI_TARGET_LATENCY, initial=16)
+        self.analysis_cache, self._seeded_urls = self._load_cache()
+        # ad_id -> video_url of cache entries, so a creative is found even if its CDN URL changed
+        self._ad_index: Dict[str, str] = {entry["ad_id"]: video_url for video_url, entry in self.analysis_cache.items() if entry.get("ad_id")}
+        # cache_lock guards the in-memory TTLCache (its LRU/expiry order is shared by all keys);
+        # file_lock serializes the journal and snapshot writers
         self.cache_lock = threading.Lock()
-        self.last_api_call_time = 0.0
-        self.api_call_lock = threading.Lock()
+        self.file_lock = threading.Lock()
+        # In-process memo of finished analyses keyed by ad_id, consulted before the URL cache
+        self._memo: Dict[str, Dict[str, Any]] = {}
+        self._stage_gates: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore, asyncio.Semaphore]] = None
+        # Structured-output configs are built once and shared by every call (and batch request)
+        self._video_config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=VideoAnalysisResult
+        )
+        # A builtin list[...] schema keeps `parsed` a list of VideoAnalysisResult objects
+        self._video_group_config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=list[VideoAnalysisResult]
+        )
+        self._summary_config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=PerAppSummaryResult
+        )
         
         if not use_mock and GEMINI_API_KEY:
              self.client = genai.Client(api_key=GEMINI_API_KEY)
@@ -68,137 +301,519 @@ class VideoAnalyzer:
              logger.warning("Initializing analyzer without Gemini API Key. Falling back to mock.")
              self.use_mock = True
 
-    def _load_cache(self) -> Dict[str, Any]:
-        """Loads analysis cache from file."""
-        if os.path.exists(self.cache_file):
-            try:
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.warning(f"Failed to load cache from {self.cache_file}: {e}")
-        return {}
+    def _load_cache(self) -> Tuple[TTLCache, set]:
+        """
+        Loads analysis cache from file into a size- and age-bounded TTLCache.
+        Entries are stored as {"analysis": ..., "cached_at": epoch, "ad_id": ...}; legacy
+        bare analyses are aged from the ISO week of the archive directory holding the file,
+        and dropped when the file is not in one. Entries appended
+        to the journal since the last compaction are replayed on top of the snapshot, and
+        entries from the seed cache younger than AD_REUSE_WINDOW_SECONDS underneath it.
+        Returns the cache and the URLs that only came from the seed.
+        """
+        cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS, timer=time.time)
+        now = time.time()
+        stored = {}
+        if self.seed_cache_file:
+            for video_url, entry in self._read_cache_snapshot(self.seed_cache_file).items():
+                if now - entry["cached_at"] < AD_REUSE_WINDOW_SECONDS:
+                    stored[video_url] = entry
+        seeded = set(stored)
+
+        own = self._read_cache_snapshot(self.cache_file)
+        stored.update(own)
+        seeded -= own.keys()
+        try:
+            with open(self.cache_journal, 'rb') as f:
+                for line in f:
+                    try:
+                        appended = jsonio.loads(line)
+                    except ValueError:
+                        # A run killed mid-append leaves at most one torn trailing line
+                        logger.warning(f"Skipping corrupt line in {self.cache_journal}.")
+                        continue
+                    stored.update(appended)
+                    seeded -= appended.keys()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to replay cache journal {self.cache_journal}: {e}")
+
+        entries = [(video_url, entry) for video_url, entry in stored.items() if now - entry["cached_at"] < CACHE_TTL_SECONDS]
+        # Oldest first, so the LRU order matches analysis order and the newest survive the size cap
+        entries.sort(key=lambda item: item[1]["cached_at"])
+        for video_url, entry in entries[-CACHE_MAX_ENTRIES:]:
+            cache[video_url] = entry
+        if seeded:
+            logger.info(f"Seeded {len(seeded & set(cache))} reusable analyses from {self.seed_cache_file}.")
+        return cache, seeded & set(cache)
+
+    def _read_cache_snapshot(self, path: str) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(path, 'rb') as f:
+                stored = jsonio.loads(f.read())
+            legacy = [video_url for video_url, entry in stored.items()
+                      if not (isinstance(entry, dict) and "analysis" in entry and "cached_at" in entry)]
+            if legacy:
+                week_end = _archive_week_end(path)
+                for video_url in legacy:
+                    if week_end is None:
+                        del stored[video_url]
+                    else:
+                        stored[video_url] = {"analysis": stored[video_url], "cached_at": min(week_end, time.time())}
+                if week_end is None:
+                    logger.warning(f"Dropped {len(legacy)} undated analyses from {path}: no archive week to age them by.")
+            return stored
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Failed to load cache from {path}: {e}")
+            return {}
+
+    def _append_cache(self, video_url: str, analysis: Dict[str, Any], ad_id: Optional[str] = None):
+        """Records one finished analysis in memory and appends it to the on-disk journal."""
+        entry = {"analysis": analysis, "cached_at": time.time()}
+        if ad_id:
+            entry["ad_id"] = ad_id
+        with self.cache_lock:
+            self.analysis_cache[video_url] = entry
+            self._seeded_urls.discard(video_url)
+            if ad_id:
+                self._ad_index[ad_id] = video_url
+        line = jsonio.dumps({video_url: entry}, indent=False) + b"\n"
+        with self.file_lock:
+            self._write_journal(line)
+
+    def _write_journal(self, line: bytes):
+        try:
+            if self._journal_fd is None:
+                # O_BINARY keeps Windows from translating the newlines
+                flags = os.O_RDWR | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+                self._journal_fd = os.open(self.cache_journal, flags, 0o644)
+                # Start on a fresh line if a previous run was killed mid-append
+                # (lseek + read rather than pread, which does not exist on Windows)
+                size = os.lseek(self._journal_fd, 0, os.SEEK_END)
+                if size:
+                    os.lseek(self._journal_fd, size - 1, os.SEEK_SET)
+                    if os.read(self._journal_fd, 1) != b"\n":
+                        os.write(self._journal_fd, b"\n")
+            # One O_APPEND write per entry: lines never interleave and a crash tears at most the last one
+            os.write(self._journal_fd, line)
+        except Exception as e:
+            # The journal is only a crash-recovery aid: never let it fail an analysis
+            logger.warning(f"Failed to append to cache journal {self.cache_journal}: {e}")
 
     def _save_cache(self):
-        """Saves current cache to file thread-safely."""
+        """Compacts the cache: writes the non-expired entries to the JSON snapshot and drops the journal."""
+        # Only the in-memory snapshot needs the cache lock; serialization and disk I/O
+        # happen under the writer lock so lookups never wait on them
         with self.cache_lock:
+            self.analysis_cache.expire()
+            # Seeded entries that were not reused this run stay in the seed's own archive
+            snapshot = {video_url: entry for video_url, entry in self.analysis_cache.items() if video_url not in self._seeded_urls}
+        with self.file_lock:
+            # Write-then-rename: a crash mid-write leaves the previous snapshot (and the journal) intact
+            tmp_path = self.cache_file + ".tmp"
             try:
-                with open(self.cache_file, 'w', encoding='utf-8') as f:
-                    json.dump(self.analysis_cache, f, ensure_ascii=False, indent=2)
+                with open(tmp_path, 'wb') as f:
+                    f.write(jsonio.dumps(snapshot))
+                os.replace(tmp_path, self.cache_file)
             except Exception as e:
                 logger.warning(f"Failed to save cache to {self.cache_file}: {e}")
+                return
+            if self._journal_fd is not None:
+                os.close(self._journal_fd)
+                self._journal_fd = None
+            try:
+                os.remove(self.cache_journal)
+            except FileNotFoundError:
+                pass
 
-    def _respect_rate_limit(self):
-        """No longer artificially limiting in pay-as-you-go mode."""
-        pass
+    def close(self):
+        """Flushes the analysis cache to its compact JSON form; call once analysis is finished."""
+        self._save_cache()
 
-    def _call_api_with_retry(self, models_to_try: List[str], contents: Any, config: types.GenerateContentConfig, max_retries: int = 3) -> Any:
-        """Generic API caller with model fallback and exponential backoff."""
-        retry_delay = 2 
+    async def _call_api_with_retry(self, models_to_try: List[str], contents: Any, config: types.GenerateContentConfig, max_retries: int = 3, est_tokens: int = 0) -> Any:
+        """
+        Generic API caller with model fallback and jittered exponential backoff.
+        Transient (5xx/network) errors are retried up to max_retries times and rate limits up to
+        RATE_LIMIT_MAX_RETRIES times, on the same model; 404s and other errors fall through to
+        the next model. Calls are smoothed by the token bucket, kept within the RPM/TPM window
+        by the rate limiter and only then admitted by the AIMD controller.
+        """
+        budgets = {ErrorClass.TRANSIENT: max_retries, ErrorClass.RATE_LIMIT: RATE_LIMIT_MAX_RETRIES}
+        retries = {ErrorClass.TRANSIENT: 0, ErrorClass.RATE_LIMIT: 0}
         last_error = None
-        for attempt in range(max_retries):
-            for model_id in models_to_try:
-                try:
-                    response = self.client.models.generate_content(
-                        model=model_id,
-                        contents=contents,
-                        config=config
-                    )
-                    return response
-                except Exception as e:
-                    last_error = e
-                    if "404" in str(e) or "not found" in str(e).lower():
-                        logger.warning(f"Model {model_id} failed (404/Not Found). Falling back to next model.")
-                        continue 
-                    if "429" in str(e) and attempt < max_retries - 1:
-                        logger.warning(f"Rate limit hit for {model_id}. Retrying in {retry_delay}s...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                        break
-                    if ("500" in str(e) or "503" in str(e)) and attempt < max_retries - 1:
-                        logger.warning(f"Server error for {model_id}. Retrying in {retry_delay}s...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                        break
-                    logger.warning(f"API Error with {model_id}: {e}. Trying fallback if available...")
+        model_index = 0
+        while model_index < len(models_to_try):
+            model_id = models_to_try[model_index]
+            try:
+                # Rate tokens are taken before the AIMD slot, so no slot is held while merely pacing
+                await self.bucket.acquire()
+                await self.limiter.acquire(est_tokens)
+                async with self.controller:
+                    started = time.monotonic()
+                    try:
+                        response = await self.client.aio.models.generate_content(
+                            model=model_id,
+                            contents=contents,
+                            config=config
+                        )
+                    except Exception as e:
+                        self.controller.record(time.monotonic() - started, throttled=_is_throttling_error(e))
+                        raise
+                    self.controller.record(time.monotonic() - started)
+                self.limiter.observe(_response_headers(response))
+                return response
+            except Exception as e:
+                last_error = e
+                self.limiter.observe(_response_headers(e))
+                error_class = _classify_error(e)
+                if error_class is ErrorClass.NOT_FOUND:
+                    logger.warning(f"Model {model_id} failed (404/Not Found). Falling back to next model.")
+                    model_index += 1
                     continue
+                if error_class in retries and retries[error_class] < budgets[error_class]:
+                    delay = _backoff_delay(retries[error_class])
+                    if error_class is ErrorClass.RATE_LIMIT:
+                        delay = _retry_after_seconds(e) or delay
+                    retries[error_class] += 1
+                    label = "Rate limit hit" if error_class is ErrorClass.RATE_LIMIT else "Server error"
+                    logger.warning(f"{label} for {model_id}. Retrying in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.warning(f"API Error with {model_id}: {e}. Trying fallback if available...")
+                model_index += 1
         raise Exception(f"Max retries exceeded or all models failed. Last error: {last_error}")
 
-    def analyze_videos_concurrently(self, videos: List[Dict[str, Any]], max_workers: int = 3) -> List[Dict[str, Any]]:
-        """Analyzes a batch of videos concurrently using threads."""
-        logger.info(f"Starting concurrent analysis for {len(videos)} videos (max_workers={max_workers})...")
-        results = [None] * len(videos)
-        
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_index = {
-                executor.submit(self.analyze_single_video, video): i 
-                for i, video in enumerate(videos)
-            }
-            
-            for future in as_completed(future_to_index):
-                i = future_to_index[future]
+    async def analyze_videos_async(self, videos: List[Dict[str, Any]], max_concurrency: Optional[int] = None, on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Analyzes a batch of videos concurrently on a single event loop.
+        All videos are scheduled at once; Gemini calls are paced by the RPM/TPM
+        limiter, and max_concurrency optionally caps in-flight videos (or video groups) as well.
+        Short videos missing from the cache share one Gemini call per VIDEO_GROUP_SIZE.
+        on_result(index, result) is invoked as each video finishes, in completion order.
+        """
+        logger.info(f"Starting async analysis for {len(videos)} videos (rpm={self.limiter.rpm}, tpm={self.limiter.tpm})...")
+        gate = asyncio.Semaphore(max_concurrency) if max_concurrency else contextlib.nullcontext()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(videos)
+
+        def finish(i: int, result: Dict[str, Any]):
+            results[i] = result
+            if on_result is not None:
+                on_result(i, result)
+
+        async def analyze_one(i: int, session: aiohttp.ClientSession):
+            try:
+                async with gate:
+                    result = await self.analyze_single_video_async(videos[i], session)
+            except Exception as e:
+                logger.error(f"Error processing video index {i}: {e}")
+                # Return original video with no analysis fallback
+                result = videos[i]
+            finish(i, result)
+
+        async def analyze_group(group: List[int], session: aiohttp.ClientSession):
+            try:
+                async with gate:
+                    group_results = await self._analyze_video_group([videos[i] for i in group], session)
+            except Exception as e:
+                logger.error(f"Error processing video indices {group}: {e}")
+                group_results = [videos[i] for i in group]
+            for i, result in zip(group, group_results):
+                finish(i, result)
+
+        async with _video_session() as session:
+            tasks = []
+            # Cached videos are resolved up front so groups are filled only with videos that need a call
+            short = []
+            for i, video in enumerate(videos):
+                if not self._is_groupable(video):
+                    tasks.append(analyze_one(i, session))
+                    continue
+                cached = self._lookup_cached(video)
+                if cached is not None:
+                    finish(i, cached)
+                else:
+                    short.append(i)
+            for start in range(0, len(short), VIDEO_GROUP_SIZE):
+                tasks.append(analyze_group(short[start:start + VIDEO_GROUP_SIZE], session))
+            await asyncio.gather(*tasks)
+        return results
+
+    async def analyze_videos_batch_async(self, videos: List[Dict[str, Any]], on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Analyzes videos through Gemini Batch Mode: one batch job carrying an inlined
+        request per uncached video, polled until done and joined back by ad_id.
+        Trades minutes of queueing for half-price, quota-free generation; videos whose
+        batch item fails (or the whole job, on error) fall back to the per-video path.
+        """
+        if self.use_mock:
+            return await self.analyze_videos_async(videos, on_result=on_result)
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(videos)
+
+        def finish(i: int, result: Dict[str, Any]):
+            results[i] = result
+            if on_result is not None:
+                on_result(i, result)
+
+        pending = []
+        for i, video in enumerate(videos):
+            cached = self._lookup_cached(video)
+            if cached is not None:
+                finish(i, cached)
+            else:
+                pending.append(i)
+        logger.info(f"Starting batch analysis for {len(pending)} videos ({len(videos) - len(pending)} cached)...")
+
+        async with _video_session() as session:
+            if pending:
+                async def prepare(i: int) -> Any:
+                    try:
+                        return await self._prepare_gemini_file(videos[i], session)
+                    except Exception as e:
+                        logger.error(f"Failed to prepare video index {i} for batch: {e}")
+                        return None
+
+                gemini_files = dict(zip(pending, await asyncio.gather(*[prepare(i) for i in pending])))
                 try:
-                    results[i] = future.result()
+                    responses = await self._run_video_batch(videos, gemini_files)
                 except Exception as e:
-                    logger.error(f"Error processing video index {i}: {e}")
-                    # Return original video with no analysis fallback
-                    results[i] = videos[i]
-                    
+                    logger.error(f"Batch job failed: {e}")
+                    responses = {}
+                finally:
+                    await asyncio.gather(*[self._delete_gemini_file(f) for f in gemini_files.values() if f])
+
+                fallback = []
+                for i in pending:
+                    try:
+                        analysis = self._parse_video_response(responses[i])
+                    except Exception as e:
+                        if i in responses:
+                            logger.warning(f"Unusable batch response for video index {i}: {e}")
+                        fallback.append(i)
+                        continue
+                    result = videos[i].copy()
+                    result["analysis"] = analysis
+                    self._remember(result)
+                    finish(i, result)
+
+                if fallback:
+                    logger.info(f"Re-running {len(fallback)} videos through the per-video path.")
+
+                    async def analyze_one(i: int):
+                        try:
+                            result = await self.analyze_single_video_async(videos[i], session)
+                        except Exception as e:
+                            logger.error(f"Error processing video index {i}: {e}")
+                            result = videos[i]
+                        finish(i, result)
+
+                    await asyncio.gather(*[analyze_one(i) for i in fallback])
+
         return results
 
+    async def _run_video_batch(self, videos: List[Dict[str, Any]], gemini_files: Dict[int, Any]) -> Dict[int, Any]:
+        """Submits one inlined batch job and returns {video index: GenerateContentResponse} for succeeded items."""
+        submitted = [i for i, gemini_file in gemini_files.items() if gemini_file is not None]
+        inlined_requests = [
+            types.InlinedRequest(
+                contents=[gemini_files[i], self._build_video_prompt(videos[i])],
+                config=self._video_config,
+                metadata={"ad_id": str(videos[i].get('ad_id') or '')},
+            )
+            for i in submitted
+        ]
+        if not inlined_requests:
+            return {}
+
+        batch_job = await self.client.aio.batches.create(
+            model="gemini-2.5-flash",
+            src=inlined_requests,
+            config={"display_name": f"slg-ad-analysis-{int(time.time())}"},
+        )
+        logger.info(f"Submitted batch job {batch_job.name} with {len(inlined_requests)} requests.")
+
+        # Poll with exponential backoff; Batch Mode targets completion within 24h, but we only
+        # wait GEMINI_BATCH_MAX_WAIT before falling back to per-video calls
+        delay = BATCH_POLL_INITIAL_SECONDS
+        deadline = time.monotonic() + BATCH_MAX_WAIT_SECONDS
+        while batch_job.state.name not in BATCH_TERMINAL_STATES:
+            if time.monotonic() >= deadline:
+                # Do not leave the job running (and billing) after giving up on it
+                try:
+                    await self.client.aio.batches.cancel(name=batch_job.name)
+                except Exception as e:
+                    logger.warning(f"Failed to cancel batch job {batch_job.name}: {e}")
+                raise TimeoutError(f"Batch job {batch_job.name} did not finish in time.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BATCH_POLL_MAX_SECONDS)
+            batch_job = await self.client.aio.batches.get(name=batch_job.name)
+            logger.info(f"Batch job {batch_job.name} state: {batch_job.state.name}")
+
+        if batch_job.state.name != "JOB_STATE_SUCCEEDED":
+            raise Exception(f"Batch job {batch_job.name} ended in {batch_job.state.name}: {batch_job.error}")
+
+        # Join results on the per-request metadata (ad_id), falling back to the
+        # documented submission order when metadata is not echoed back
+        index_by_ad_id = {str(videos[i].get('ad_id')): i for i in submitted if videos[i].get('ad_id')}
+        responses = {}
+        for position, item in enumerate(batch_job.dest.inlined_responses or []):
+            metadata = getattr(item, 'metadata', None) or {}
+            i = index_by_ad_id.get(metadata.get("ad_id"))
+            if i is None and position < len(submitted):
+                i = submitted[position]
+            if item.error or item.response is None:
+                logger.warning(f"Batch item for video index {i} failed: {item.error}")
+                continue
+            responses[i] = item.response
+        return responses
+
+    def analyze_videos_concurrently(self, videos: List[Dict[str, Any]], max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Synchronous wrapper around analyze_videos_async, kept for existing callers."""
+        return asyncio.run(self.analyze_videos_async(videos, max_concurrency=max_workers))
+
+    def analyze_videos_batch(self, videos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Synchronous wrapper around analyze_videos_batch_async."""
+        return asyncio.run(self.analyze_videos_batch_async(videos))
+
     def analyze_single_video(self, video_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Synchronous wrapper that analyzes a single video ad."""
+        return self.analyze_videos_concurrently([video_data])[0]
+
+    async def analyze_single_video_async(self, video_data: Dict[str, Any], session: aiohttp.ClientSession) -> Dict[str, Any]:
         """Analyzes a single video ad to extract key dimensions."""
         logger.info(f"Analyzing video: {video_data.get('app_name')} - Rank {video_data.get('rank')}")
         
-        video_url = video_data.get('video_url')
-        with self.cache_lock:
-            if video_url and video_url in self.analysis_cache:
-                logger.info(f"Using cached analysis for this video URL.")
-                result = video_data.copy()
-                result["analysis"] = self.analysis_cache[video_url]
-                return result
+        cached = self._lookup_cached(video_data)
+        if cached is not None:
+            return cached
         
         if self.use_mock:
-            result = self._mock_single_analysis(video_data)
-        else:
-            try:
-                result = self._real_single_analysis(video_data)
-            except Exception as e:
-                logger.error(f"Error during video analysis for {video_data.get('app_name')}: {e}")
-                logger.info("Falling back to mock data for this video.")
-                result = self._mock_single_analysis(video_data)
+            await asyncio.sleep(1) # simulate brief delay
+            return self._mock_single_analysis(video_data)
+        try:
+            result = await self._real_single_analysis(video_data, session)
+        except Exception as e:
+            logger.error(f"Error during video analysis for {video_data.get('app_name')}: {e}")
+            logger.info("Falling back to mock data for this video.")
+            # Placeholder analyses are never cached, so the video is retried on the next run
+            return self._mock_single_analysis(video_data)
                 
-        if video_url and "analysis" in result:
-             with self.cache_lock:
-                 self.analysis_cache[video_url] = result["analysis"]
-             self._save_cache()
-             
+        self._remember(result)
         return result
 
-    def _real_single_analysis(self, video_data: Dict[str, Any]) -> Dict[str, Any]:
+    def _lookup_cached(self, video_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Returns video_data with a known analysis, or None. Checks the in-process memo and
+        the persisted cache by ad_id first, then the cache by video URL.
+        """
+        ad_id = video_data.get('ad_id')
+        memo_hit = self._memo.get(ad_id) if ad_id else None
+        if memo_hit is not None:
+            logger.info(f"Using memoized analysis for ad {ad_id}.")
+            result = video_data.copy()
+            result["analysis"] = memo_hit
+            return result
+
+        video_url = video_data.get('video_url')
+        with self.cache_lock:
+            cached_url = self._ad_index.get(ad_id) if ad_id else None
+            cached = self.analysis_cache.get(cached_url) if cached_url else None
+            if cached is not None:
+                source = f"ad {ad_id}"
+            elif video_url:
+                cached_url = video_url
+                cached = self.analysis_cache.get(video_url)
+                source = "this video URL"
+            from_seed = cached is not None and cached_url in self._seeded_urls
+        if cached is None:
+            return None
+        logger.info(f"Using cached analysis for {source}.")
+        result = video_data.copy()
+        result["analysis"] = cached["analysis"]
+        if ad_id:
+            self._memo[ad_id] = result["analysis"]
+        if from_seed and video_url:
+            # Carry the reused analysis into this run's cache so the archive stays complete
+            self._append_cache(video_url, result["analysis"], ad_id)
+        return result
+
+    def _remember(self, result: Dict[str, Any]):
+        """Stores a finished analysis in the in-process memo and the on-disk cache."""
+        if "analysis" not in result:
+            return
+        ad_id = result.get('ad_id')
+        video_url = result.get('video_url')
+        if ad_id:
+            self._memo[ad_id] = result["analysis"]
+        if video_url:
+            self._append_cache(video_url, result["analysis"], ad_id)
+
+    @retry(
+        stop=stop_after_attempt(4),
+        wait=wait_exponential_jitter(initial=1, max=30),
+        retry=retry_if_exception(_is_transient_download_error),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+        reraise=True,
+    )
+    async def _download_video(self, session: aiohttp.ClientSession, video_url: str) -> io.BytesIO:
+        """
+        Streams the video into memory, restarting from scratch on transient network errors.
+        Videos over MAX_VIDEO_BYTES are rejected from the response headers, before the body
+        is read, or as soon as the streamed size passes the cap when no length is sent.
+        """
+        timeout = aiohttp.ClientTimeout(sock_connect=30, sock_read=30)
+        buffer = io.BytesIO()
+        async with session.get(video_url, timeout=timeout) as response:
+            response.raise_for_status()
+            if response.content_length and response.content_length > MAX_VIDEO_BYTES:
+                raise ValueError(f"Video is {response.content_length / (1 << 20):.0f} MB, over the {MAX_VIDEO_BYTES >> 20} MB cap.")
+            async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+                if buffer.tell() > MAX_VIDEO_BYTES:
+                    raise ValueError(f"Video exceeds the {MAX_VIDEO_BYTES >> 20} MB cap.")
+        return buffer
+
+    @retry(
+        stop=stop_after_attempt(4),
+        wait=wait_exponential_jitter(initial=1, max=30),
+        retry=retry_if_exception(_is_throttling_error),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+        reraise=True,
+    )
+    async def _upload_video(self, video: io.BytesIO) -> Any:
+        """Uploads an in-memory video to the Gemini File API, retrying 429/5xx responses."""
+        # The SDK uploads from the current position, so every attempt starts over
+        video.seek(0)
+        return await self.client.aio.files.upload(file=video, config={"mime_type": "video/mp4"})
+
+    async def _prepare_gemini_file(self, video_data: Dict[str, Any], session: aiohttp.ClientSession) -> Any:
+        """Downloads the ad video, uploads it to the Gemini File API and waits until it is ACTIVE."""
         video_url = video_data.get('video_url')
         if not video_url:
             raise ValueError("No video URL provided.")
-            
+
         gemini_file = None
-        temp_file_path = None
-        
         try:
-            # 1. Download video temporarily
-            logger.info(f"Downloading video from {video_url[:50]}...")
-            import urllib3
-            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            
-            response = requests.get(video_url, stream=True, timeout=30, verify=False)
-            response.raise_for_status()
-            
-            fd, temp_file_path = tempfile.mkstemp(suffix=".mp4")
-            with os.fdopen(fd, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            download_gate, upload_gate = self._pipeline_gates()
+
+            # 1. Download video into memory (no temp file round-trip through disk)
+            async with download_gate:
+                logger.info(f"Downloading video from {video_url[:50]}...")
+                video = await self._download_video(session, video_url)
+                # Hand the download slot over only once an upload slot is free, so at most
+                # DOWNLOAD_CONCURRENCY + UPLOAD_CONCURRENCY videos are held in memory
+                await upload_gate.acquire()
                     
             # 2. Upload to Gemini File API
-            logger.info("Uploading video to Gemini...")
-            gemini_file = self.client.files.upload(file=temp_file_path)
+            try:
+                logger.info("Uploading video to Gemini...")
+                gemini_file = await self._upload_video(video)
+            finally:
+                upload_gate.release()
+                video.close()
             
             # 3. Wait for processing (with timeout protection)
             logger.info("Waiting for video processing...")
@@ -209,96 +824,162 @@ class VideoAnalyzer:
             while gemini_file.state.name == "PROCESSING":
                 if waited >= max_wait_time:
                     raise TimeoutError("Video processing timed out in Gemini.")
-                time.sleep(wait_interval)
+                await asyncio.sleep(wait_interval)
                 waited += wait_interval
-                gemini_file = self.client.files.get(name=gemini_file.name)
+                gemini_file = await self.client.aio.files.get(name=gemini_file.name)
                 
             if gemini_file.state.name == "FAILED":
                 raise Exception("Video processing failed inside Gemini.")
-                
-            # 4. Generate Content (Using generic caller and schema parsing)
-            logger.info("Generating structural analysis...")
-            prompt = f"""
-            你是一位资深的移动游戏广告（特别是 SLG 策略游戏）分析专家。请分析以下视频广告。
-            游戏名称: {video_data.get('app_name')}
-            投放渠道: {video_data.get('ad_network')}
-            
-            请严格按照以下 5 个维度分析该视频的内容，并以纯 JSON 格式输出（内容必须全部是简体中文）。
-            【极其重要：每个维度的分析结果极其精简，绝不能超过 100 个中文字！】
-            
-            1. hook_design (前 3 秒钩子设计：它是如何抓人眼球的？限100字内)
-            2. emotional_appeal (情绪导向：它唤起了什么情绪？如焦虑、解压、挫败感等。限100字内)
-            3. content_structure (核心内容结构：剧情的起承转合或游戏玩法的展示顺序是什么？限100字内)
-            4. wow_factor (爆点/爽点要素：视频中最核心的视觉奇观或最令人满足的瞬间是什么？限100字内)
-            5. copywriting_features (文案特征与 CTA：分析屏幕文字、配音台词以及转化按钮的特点。限50字内)
-            6. video_script (视频脚本拆解：作为附加输出，将视频拆解为多个镜头，提取角色、布景、画面描述等，并必须附带准确的开始秒数和结束秒数。详见返回的 JSON 结构要求。)
-            
-            【关于 video_script 拆解的 Few-Shot 标准范例参考】：
-            "validation_goal": "经营危机感/紧迫感作为hook/贯彻全程对点击/成本的影响",
-            "overall_process": "经营冲突->解决冲突->新经营冲突->解决冲突->外部冲突->招募英雄->扩建展示",
-            "shots": [
-                {{
-                    "shot_number": 1,
-                    "start_timestamp": 0,
-                    "end_timestamp": 3,
-                    "Character": "警察，女囚犯",
-                    "weapon": "手枪，AK47",
-                    "scene": "整体场景做出室内感+中世纪风格，室外为草地+积雪",
-                    "camera": "斜45度上帝视角",
-                    "detailed_action": "开场酒馆门口聚集成群的顾客全身满是污泥，人群上面有两种emoji（生气冒火/不耐烦）",
-                    "sound_effect": "人群嘈杂声、生气发火声"
-                }},
-                {{
-                    "shot_number": 2,
-                    "start_timestamp": 3,
-                    "end_timestamp": 8,
-                    "Character": "警察，女囚犯",
-                    "weapon": "手枪，AK47",
-                    "scene": "超大木质浴盆",
-                    "camera": "斜45度上帝视角",
-                    "detailed_action": "镜头向右上平移回到“主角居中”位置，主角向左下移动，抱起两名顾客走到浴池边（超大木质浴盆），蓄力0.3s后将客人扔进水中；客人进入水中前，湖面右侧耐心值UI持续上涨，在客人入水前，耐心值（生气）临近顶点",
-                    "sound_effect": "无"
-                }}
-            ]
-            请务必参考并严格遵守这一分镜拆解的颗粒度和精简结构！特别是每个分镜必须要有与之对应的视频起始与结束秒数（整数），不要留空！
-            """
-            
-            config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=VideoAnalysisResult
-            )
-            
-            api_response = self._call_api_with_retry(
-                models_to_try=["gemini-2.5-flash"],
-                contents=[gemini_file, prompt],
-                config=config
-            )
-            
-            # Use SDK's parsed object directly, fall back to json.loads if unexpectedly missing
-            if getattr(api_response, 'parsed', None):
-                analysis_json = api_response.parsed.model_dump()
-            else:
-                analysis_json = json.loads(api_response.text)
-            
-            result = video_data.copy()
-            result["analysis"] = analysis_json
-            return result
-            
+            return gemini_file
+        except BaseException:
+            if gemini_file:
+                await self._delete_gemini_file(gemini_file)
+            raise
+
+    def _pipeline_gates(self) -> Tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        """Returns the (download, upload) stage semaphores, created once per event loop."""
+        loop = asyncio.get_running_loop()
+        if self._stage_gates is None or self._stage_gates[0] is not loop:
+            self._stage_gates = (loop, asyncio.Semaphore(DOWNLOAD_CONCURRENCY), asyncio.Semaphore(UPLOAD_CONCURRENCY))
+        return self._stage_gates[1], self._stage_gates[2]
+
+    async def _delete_gemini_file(self, gemini_file: Any):
+        try:
+            await self.client.aio.files.delete(name=gemini_file.name)
+        except Exception as e:
+            logger.warning(f"Failed to delete Gemini file {gemini_file.name}: {e}")
+
+    def _build_video_prompt(self, video_data: Dict[str, Any]) -> str:
+        return f"""
+        你是一位资深的移动游戏广告（特别是 SLG 策略游戏）分析专家。请分析以下视频广告。
+        游戏名称: {video_data.get('app_name')}
+        投放渠道: {video_data.get('ad_network')}
+        {VIDEO_ANALYSIS_INSTRUCTIONS}"""
+
+    def _build_video_group_prompt(self, count: int) -> str:
+        return f"""
+        你是一位资深的移动游戏广告（特别是 SLG 策略游戏）分析专家。上面依次给出了 {count} 条视频广告，每条视频后标注了编号、游戏名称和投放渠道。
+        请对每条视频分别进行分析，输出一个 JSON 数组：按视频编号顺序，每条视频对应一个元素，共 {count} 个元素，不同视频的分析内容不要混淆。
+        {VIDEO_ANALYSIS_INSTRUCTIONS}"""
+
+    def _estimate_video_tokens(self, video_data: Dict[str, Any], prompt: str) -> int:
+        return (video_data.get('duration_seconds') or 60) * VIDEO_TOKENS_PER_SECOND + len(prompt)
+
+    def _parse_video_response(self, api_response: Any) -> Dict[str, Any]:
+        # Use SDK's parsed object directly, fall back to parsing the raw text if unexpectedly missing
+        if getattr(api_response, 'parsed', None):
+            return api_response.parsed.model_dump()
+        return _VIDEO_ADAPTER.validate_json(api_response.text).model_dump()
+
+    async def _real_single_analysis(self, video_data: Dict[str, Any], session: aiohttp.ClientSession) -> Dict[str, Any]:
+        gemini_file = await self._prepare_gemini_file(video_data, session)
+        try:
+            return await self._generate_analysis(video_data, gemini_file)
         finally:
             # Cleanup resources
-            if gemini_file:
+            await self._delete_gemini_file(gemini_file)
+
+    async def _generate_analysis(self, video_data: Dict[str, Any], gemini_file: Any) -> Dict[str, Any]:
+        # 4. Generate Content (Using generic caller and schema parsing)
+        logger.info("Generating structural analysis...")
+        prompt = self._build_video_prompt(video_data)
+        api_response = await self._call_api_with_retry(
+            models_to_try=["gemini-2.5-flash"],
+            contents=[gemini_file, prompt],
+            config=self._video_config,
+            est_tokens=self._estimate_video_tokens(video_data, prompt)
+        )
+        
+        result = video_data.copy()
+        result["analysis"] = self._parse_video_response(api_response)
+        return result
+
+    def _is_groupable(self, video_data: Dict[str, Any]) -> bool:
+        duration = video_data.get('duration_seconds') or 0
+        return not self.use_mock and 0 < duration <= VIDEO_GROUP_MAX_SECONDS
+
+    async def _analyze_video_group(self, videos: List[Dict[str, Any]], session: aiohttp.ClientSession) -> List[Dict[str, Any]]:
+        """
+        Analyzes up to VIDEO_GROUP_SIZE short videos with a single generate call.
+        Each video is still downloaded and uploaded on its own; if the grouped call fails or
+        returns the wrong number of analyses, the uploaded files are analyzed one call each.
+        """
+        if len(videos) == 1:
+            return [await self.analyze_single_video_async(videos[0], session)]
+        for video_data in videos:
+            logger.info(f"Analyzing video: {video_data.get('app_name')} - Rank {video_data.get('rank')} (grouped)")
+
+        prepared = await asyncio.gather(*[self._prepare_gemini_file(v, session) for v in videos], return_exceptions=True)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(videos)
+        ready = []
+        for k, (video_data, gemini_file) in enumerate(zip(videos, prepared)):
+            if isinstance(gemini_file, BaseException):
+                logger.error(f"Error during video analysis for {video_data.get('app_name')}: {gemini_file}")
+                logger.info("Falling back to mock data for this video.")
+                results[k] = self._mock_single_analysis(video_data)
+            else:
+                ready.append(k)
+
+        try:
+            analyses = None
+            if len(ready) > 1:
                 try:
-                    self.client.files.delete(name=gemini_file.name)
+                    analyses = await self._generate_group_analyses([videos[k] for k in ready], [prepared[k] for k in ready])
                 except Exception as e:
-                    logger.warning(f"Failed to delete Gemini file {gemini_file.name}: {e}")
-            if temp_file_path and os.path.exists(temp_file_path):
+                    logger.warning(f"Grouped analysis of {len(ready)} videos failed: {e}. Analyzing them one by one.")
+
+            async def analyze_alone(k: int) -> Dict[str, Any]:
                 try:
-                    os.remove(temp_file_path)
+                    result = await self._generate_analysis(videos[k], prepared[k])
                 except Exception as e:
-                    logger.warning(f"Failed to delete local temp file {temp_file_path}: {e}")
+                    logger.error(f"Error during video analysis for {videos[k].get('app_name')}: {e}")
+                    logger.info("Falling back to mock data for this video.")
+                    return self._mock_single_analysis(videos[k])
+                self._remember(result)
+                return result
+
+            if analyses is not None:
+                for k, analysis in zip(ready, analyses):
+                    result = videos[k].copy()
+                    result["analysis"] = analysis
+                    self._remember(result)
+                    results[k] = result
+            else:
+                for k, result in zip(ready, await asyncio.gather(*[analyze_alone(k) for k in ready])):
+                    results[k] = result
+        finally:
+            # Cleanup resources
+            await asyncio.gather(*[self._delete_gemini_file(prepared[k]) for k in ready])
+        return results
+
+    async def _generate_group_analyses(self, videos: List[Dict[str, Any]], gemini_files: List[Any]) -> List[Dict[str, Any]]:
+        """Runs one generate call over several uploaded videos and returns their analyses in order."""
+        logger.info(f"Generating structural analysis for {len(videos)} grouped videos...")
+        contents: List[Any] = []
+        for number, (video_data, gemini_file) in enumerate(zip(videos, gemini_files), start=1):
+            contents.append(gemini_file)
+            contents.append(f"视频 {number}：游戏名称: {video_data.get('app_name')}，投放渠道: {video_data.get('ad_network')}")
+        prompt = self._build_video_group_prompt(len(videos))
+        contents.append(prompt)
+        api_response = await self._call_api_with_retry(
+            models_to_try=["gemini-2.5-flash"],
+            contents=contents,
+            config=self._video_group_config,
+            est_tokens=sum(self._estimate_video_tokens(v, "") for v in videos) + len(prompt)
+        )
+
+        parsed = getattr(api_response, 'parsed', None)
+        items = _VIDEO_LIST_ADAPTER.validate_python(parsed) if parsed else _VIDEO_LIST_ADAPTER.validate_json(api_response.text)
+        if len(items) != len(videos):
+            raise ValueError(f"expected {len(videos)} analyses, got {len(items)}")
+        return [item.model_dump() for item in items]
 
 
     def generate_per_app_strategy_summaries(self, all_analyzed_videos: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Synchronous wrapper around generate_per_app_strategy_summaries_async."""
+        return asyncio.run(self.generate_per_app_strategy_summaries_async(all_analyzed_videos))
+
+    async def generate_per_app_strategy_summaries_async(self, all_analyzed_videos: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
         """Summarizes video analyses on a per-app basis."""
         logger.info("Generating per-app strategic summaries...")
 
@@ -315,91 +996,76 @@ class VideoAnalyzer:
                 apps_data[app_name] = []
             apps_data[app_name].append(video)
 
-        app_summaries = {}
-        
         # Max concurrency for pay-as-you-go
-        max_workers = min(10, len(apps_data)) if apps_data else 1
+        semaphore = asyncio.Semaphore(SUMMARY_MAX_CONCURRENCY)
+        outcomes = await asyncio.gather(
+            *[self._summarize_app(app_name, videos, semaphore) for app_name, videos in apps_data.items()],
+            return_exceptions=True
+        )
+        return _collect_app_summaries(outcomes)
+
+    async def _summarize_app(self, app_name: str, videos: List[Dict[str, Any]], semaphore: asyncio.Semaphore) -> tuple:
+        logger.info(f"Generating summary for app: {app_name}")
         
-        def process_single_app(app_name: str, videos: List[Dict[str, Any]]) -> tuple:
-            logger.info(f"Generating summary for app: {app_name}")
-            
-            compiled_texts = []
-            for item in videos:
-                if "analysis" in item:
-                    a = item['analysis']
-                    channel = item.get('channel', 'Unknown')
-                    rank = item.get('rank', 'N/A')
-                    rank_change = item.get('rank_change', 'N/A')
-                    share = item.get('share', 'N/A')
-                    
-                    compact = f"钩子:{a.get('hook_design','')} 情绪:{a.get('emotional_appeal','')} 结构:{a.get('content_structure','')} 爽点:{a.get('wow_factor','')} 文案:{a.get('copywriting_features','')}"
-                    compiled_texts.append(f"【{channel.capitalize()} 排名: {rank} (较上周变化: {rank_change}, 份额: {share})】\n分析:{compact}")
-            
-            analyses_text = f"【{app_name} 本周爆款素材分析数据】\n" + "\n\n".join(compiled_texts)
-            
-            prompt = f"""
-            你是一位顶尖的移动游戏（特别是 SLG 品类）竞品买量攻防战略专家。
-            以下是我们通过监控捕获的本周【{app_name}】这款游戏，在各大渠道（Applovin、Facebook、YouTube）上排名前列的爆款视频广告结构化分析结果。
-            
-            {analyses_text}
-            
-            【你的任务】
-            请仔细阅读该游戏本周的爆款素材数据，深挖该游戏本周买量端的**核心动向和意图**。
-            在总结时，请特别注意：
-            1. 它当前主推的美术风格、包装的“爽点”或“痛点”是什么。
-            2. 数据中的排名变化（如 NEW 代表本周新晋爆款，或排名上升/下降）和曝光份额。请结合这些数据，深度分析从上一周到这一周，为什么某些素材会增加曝光（如：验证了新爽点、新颖度高），而另一些会减少曝光（如：受众疲劳、方向跑偏）。
-            3. 关注该游戏在不同渠道（如 Applovin vs Facebook）的素材是不是有一套相同的解法，还是呈现出了显著的差异化打法。
-            4. 必须明确提示用户去重点关注哪几条你认为最有潜力、值得借鉴的素材（例如新晋高排名、排名飙升的黑马）。
-            
-            【⚠️ 核心排版与语言要求 ⚠️】
-            1. 结构化输出：必须采用“结论先行 + 要点拆解”的结构。
-            2. 极简句式：拒绝长篇大论！使用“短句 + 动词”的表达形式（如：“主打生存爽感”、“弱化城建元素”）。
-            3. HTML 标签格式：你的输出是 JSON，但 JSON 的值必须包含格式化的 HTML 标签，具体格式为：
-               `<strong>一句话核心动向/结论</strong><ul><li>针对性要点一（短句带动作）</li><li>针对性要点二（短句带动作）</li></ul>`
-            
-            请严格按照以下 3 个维度提取该竞品的核心洞察，并以纯 JSON 格式输出（内容必须全部是简体中文，且遵循上述 HTML 标签格式）：
-            
-            1. hit_patterns (本周核心套路与曝光增减分析：提取该游戏本周爆款素材的共性机制，它主推的核心吸量包装和用户爽点是什么？结合排名变化分析素材增减曝光的深层原因。(重点参考份额高或新上的素材))
-            2. channel_strategy (渠道差异化打法：该游戏在各个渠道的投放侧重点是否存在差异？比如某一渠道主打解压，另一渠道主打擦边偏好？)
-            3. counter_strategy (我方应对策略及潜力素材推荐：针对该产品的吸量点我们该如何防守或借鉴？请给出具体的素材测试建议，**并务必指出哪几条具体素材（列出特征或排名）具有爆发潜力，值得我方重点关注**。)
-            """
-            
-            config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=PerAppSummaryResult
-            )
-            
-            try:
-                api_response = self._call_api_with_retry(
+        compiled_texts = []
+        for item in videos:
+            if "analysis" in item:
+                a = item['analysis']
+                channel = item.get('channel', 'Unknown')
+                rank = item.get('rank', 'N/A')
+                rank_change = item.get('rank_change', 'N/A')
+                share = item.get('share', 'N/A')
+                
+                compact = _compact_analysis(a)
+                compiled_texts.append(f"【{channel.capitalize()} 排名: {rank} (较上周变化: {rank_change}, 份额: {share})】\n分析:{compact}")
+        
+        analyses_text = f"【{app_name} 本周爆款素材分析数据】\n" + "\n\n".join(compiled_texts)
+        
+        prompt = f"""
+        你是一位顶尖的移动游戏（特别是 SLG 品类）竞品买量攻防战略专家。
+        以下是我们通过监控捕获的本周【{app_name}】这款游戏，在各大渠道（Applovin、Facebook、YouTube）上排名前列的爆款视频广告结构化分析结果。
+        
+        {analyses_text}
+        
+        【你的任务】
+        请仔细阅读该游戏本周的爆款素材数据，深挖该游戏本周买量端的**核心动向和意图**。
+        在总结时，请特别注意：
+        1. 它当前主推的美术风格、包装的“爽点”或“痛点”是什么。
+        2. 数据中的排名变化（如 NEW 代表本周新晋爆款，或排名上升/下降）和曝光份额。请结合这些数据，深度分析从上一周到这一周，为什么某些素材会增加曝光（如：验证了新爽点、新颖度高），而另一些会减少曝光（如：受众疲劳、方向跑偏）。
+        3. 关注该游戏在不同渠道（如 Applovin vs Facebook）的素材是不是有一套相同的解法，还是呈现出了显著的差异化打法。
+        4. 必须明确提示用户去重点关注哪几条你认为最有潜力、值得借鉴的素材（例如新晋高排名、排名飙升的黑马）。
+        
+        【⚠️ 核心排版与语言要求 ⚠️】
+        1. 结构化输出：必须采用“结论先行 + 要点拆解”的结构。
+        2. 极简句式：拒绝长篇大论！使用“短句 + 动词”的表达形式（如：“主打生存爽感”、“弱化城建元素”）。
+        3. HTML 标签格式：你的输出是 JSON，但 JSON 的值必须包含格式化的 HTML 标签，具体格式为：
+           `<strong>一句话核心动向/结论</strong><ul><li>针对性要点一（短句带动作）</li><li>针对性要点二（短句带动作）</li></ul>`
+        
+        请严格按照以下 3 个维度提取该竞品的核心洞察，并以纯 JSON 格式输出（内容必须全部是简体中文，且遵循上述 HTML 标签格式）：
+        
+        1. hit_patterns (本周核心套路与曝光增减分析：提取该游戏本周爆款素材的共性机制，它主推的核心吸量包装和用户爽点是什么？结合排名变化分析素材增减曝光的深层原因。(重点参考份额高或新上的素材))
+        2. channel_strategy (渠道差异化打法：该游戏在各个渠道的投放侧重点是否存在差异？比如某一渠道主打解压，另一渠道主打擦边偏好？)
+        3. counter_strategy (我方应对策略及潜力素材推荐：针对该产品的吸量点我们该如何防守或借鉴？请给出具体的素材测试建议，**并务必指出哪几条具体素材（列出特征或排名）具有爆发潜力，值得我方重点关注**。)
+        """
+        
+        try:
+            async with semaphore:
+                api_response = await self._call_api_with_retry(
                     models_to_try=["gemini-3.1-pro-preview", "gemini-2.5-pro"],
                     contents=prompt,
-                    config=config
+                    config=self._summary_config,
+                    est_tokens=len(prompt)
                 )
-                
-                if getattr(api_response, 'parsed', None):
-                    summary_json = api_response.parsed.model_dump()
-                else:
-                    summary_json = json.loads(api_response.text)
-                    
-                return (app_name, summary_json)
-            except Exception as e:
-                logger.error(f"Error generating summary for {app_name}: {e}")
-                return (app_name, self._mock_strategy_summary_data())
-
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_app = {
-                executor.submit(process_single_app, app_name, videos): app_name 
-                for app_name, videos in apps_data.items()
-            }
             
-            for future in as_completed(future_to_app):
-                try:
-                    app_name, summary = future.result()
-                    app_summaries[app_name] = summary
-                except Exception as e:
-                    logger.error(f"Failed to generate summary via thread: {e}")
-
-        return app_summaries
+            if getattr(api_response, 'parsed', None):
+                summary_json = api_response.parsed.model_dump()
+            else:
+                summary_json = _SUMMARY_ADAPTER.validate_json(api_response.text).model_dump()
+                
+            return (app_name, summary_json)
+        except Exception as e:
+            logger.error(f"Error generating summary for {app_name}: {e}")
+            return (app_name, self._mock_strategy_summary_data())
 
     def _mock_single_analysis(self, video_data: Dict[str, Any]) -> Dict[str, Any]:
         """Returns mock structured analysis for a video."""
@@ -441,7 +1107,6 @@ class VideoAnalyzer:
                 }
             }
         })
-        time.sleep(1) # simulate brief delay
         return result
         
     def _mock_per_app_strategy_summaries(self) -> Dict[str, Dict[str, Any]]:
@@ -457,6 +1122,52 @@ class VideoAnalyzer:
             "counter_strategy": "<strong>立刻转移测试视点至“高压互动”。</strong><ul><li>放弃传统城建升级套路</li><li>前 5 秒切入“A/B 二选一”生死局</li><li>强化即时反馈与危机解决爽感</li></ul>"
         }
 
+
+class SpeculativeAppSummaries:
+    """
+    Starts each app's strategy summary as soon as the last of that app's videos is
+    analyzed, instead of waiting for the whole batch; feed it through add() (an
+    on_result callback for analyze_videos_async) and await collect() at the end.
+    Produces the same summaries as generate_per_app_strategy_summaries_async(results).
+    """
+
+    def __init__(self, analyzer: VideoAnalyzer, videos: List[Dict[str, Any]]):
+        self.analyzer = analyzer
+        self._app_indices: Dict[str, List[int]] = {}
+        for i, video in enumerate(videos):
+            app_name = video.get('app_name')
+            if app_name:
+                self._app_indices.setdefault(app_name, []).append(i)
+        self._remaining = {app_name: len(indices) for app_name, indices in self._app_indices.items()}
+        self._results: Dict[int, Dict[str, Any]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(SUMMARY_MAX_CONCURRENCY)
+        self._enabled = not analyzer.use_mock and bool(videos)
+
+    def add(self, index: int, result: Dict[str, Any]):
+        self._results[index] = result
+        app_name = result.get('app_name')
+        if not self._enabled or app_name not in self._remaining:
+            return
+        self._remaining[app_name] -= 1
+        if self._remaining[app_name] == 0:
+            self._start(app_name)
+
+    def _start(self, app_name: str):
+        videos = [self._results[i] for i in self._app_indices[app_name] if i in self._results]
+        logger.info(f"All {len(videos)} videos of {app_name} analyzed; starting its summary early.")
+        self._tasks[app_name] = asyncio.create_task(self.analyzer._summarize_app(app_name, videos, self._semaphore))
+
+    async def collect(self) -> Dict[str, Dict[str, Any]]:
+        """Waits for every app's summary, starting any that never saw all of its videos."""
+        if not self._enabled:
+            return self.analyzer._mock_per_app_strategy_summaries()
+        for app_name in self._app_indices:
+            if app_name not in self._tasks:
+                self._start(app_name)
+        outcomes = await asyncio.gather(*[self._tasks[app_name] for app_name in self._app_indices], return_exceptions=True)
+        return _collect_app_summaries(outcomes)
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
     analyzer = VideoAnalyzer(use_mock=True)
@@ -8,6 +8,19 @@ SENSOR_TOWER_API_KEY = os.getenv("SENSOR_TOWER_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 REPORT_OUTPUT_DIR = os.getenv("REPORT_OUTPUT_DIR", "reports")
 
+# Gemini per-minute quotas used by the client-side rate limiter
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "60"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+# Steady Gemini request rate (per second) enforced by a token bucket; 0 derives it from GEMINI_RPM
+GEMINI_RPS = float(os.getenv("GEMINI_RPS", "0"))
+# Mean generate_content latency (seconds) above which the AIMD controller lowers concurrency
+GEMINI_TARGET_LATENCY = float(os.getenv("GEMINI_TARGET_LATENCY", "60"))
+# Longest wait (seconds) for a Gemini Batch Mode job before falling back to per-video calls; kept
+# well under the 6h GitHub-hosted runner job limit so the fallback and file cleanup still run
+GEMINI_BATCH_MAX_WAIT = int(os.getenv("GEMINI_BATCH_MAX_WAIT", str(4 * 3600)))
+# TLS certificate checks for ad video CDN downloads (off by default, as some ad CDNs serve invalid certificates)
+VIDEO_DOWNLOAD_VERIFY_TLS = os.getenv("VIDEO_DOWNLOAD_VERIFY_TLS", "").lower() in ("1", "true", "yes")
+
 # Validate critical API keys (you can disable this during initial local testing without keys)
 if not SENSOR_TOWER_API_KEY:
     print("WARNING: SENSOR_TOWER_API_KEY is not set in the environment.")
@@ -2,14 +2,32 @@ import json
 import logging
 import os
 import random
+import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
+from tenacity import RetryError, before_sleep_log, retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
+from src import jsonio
 from src.config import SENSOR_TOWER_API_KEY
 
 logger = logging.getLogger(__name__)
 
+# Sensor Tower responses worth retrying; anything else is handled by the caller as before
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# /top pages requested ahead of the one being filtered, per network
+PAGE_PREFETCH = 3
+
+
+def _is_transient_request_error(error: BaseException) -> bool:
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code in TRANSIENT_STATUS_CODES
+
+
 class SensorTowerFetcher:
     """Fetcher for retrieving Top 30 video ads data."""
 
@@ -41,6 +59,10 @@ class SensorTowerFetcher:
              self.use_mock = True
 
         self.base_url = "https://api.sensortower.com/v1"
+        # One keep-alive pool for every Sensor Tower page/share request instead of a TLS handshake per call.
+        # Retries stay with tenacity in _get, so the adapter itself never retries.
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0))
         self.target_apps = [
             "kingshot",
             "Whiteout Survival",
@@ -56,6 +78,9 @@ class SensorTowerFetcher:
             "TopHeroes",
             "Lands of Jail",
         ]
+        # Case-insensitive substring match against all targets in a single regex scan
+        self._targets_lower = [target.lower() for target in self.target_apps]
+        self._target_re = re.compile("|".join(re.escape(target) for target in self._targets_lower))
 
     def _get_company(self, app_name: str) -> str:
         """Return the publisher company name for a given app name."""
@@ -73,15 +98,27 @@ class SensorTowerFetcher:
         if cache_file and os.path.exists(cache_file):
             logger.info(f"💾 Found existing raw data cache at {cache_file}. Loading from cache to save API costs!")
             try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(cache_file, 'rb') as f:
+                    data = jsonio.loads(f.read())
+                # Archives written before videos carried their channel
+                for channel in ("applovin", "facebook", "youtube"):
+                    for video in data.get(channel, []):
+                        video.setdefault("channel", channel)
+                return data
             except Exception as e:
                 logger.error(f"Failed to load cache from {cache_file}: {e}. Proceeding with API fetch.")
 
+        if self.use_mock:
+            logger.info("Generating mock Top 50 SLG Video Ads...")
+            return self._generate_mock_data(count=50)
+
         logger.info("Fetching Top 50 SLG Video Ads...")
             
         try:
             return self._fetch_real_data()
+        except RetryError:
+            # Persistent network failure: surface it instead of publishing a mock report
+            raise
         except Exception as e:
             logger.error(f"Failed to fetch real data: {e}. Falling back to mock data.")
             return self._generate_mock_data(count=50)
@@ -117,17 +154,39 @@ class SensorTowerFetcher:
             "page": 1
         }
 
+        # The networks are independent, so they are fetched side by side. Each one fills its own
+        # monitored_apps dict; merging them in network order keeps the first-seen app order.
+        networks = ["Applovin", "Facebook", "Youtube"]
+        network_apps = {network: {} for network in networks}
+        with ThreadPoolExecutor(max_workers=len(networks)) as executor:
+            futures = {
+                network: executor.submit(self._fetch_top_for_network, network, base_params, start_str, end_str, network_apps[network])
+                for network in networks
+            }
+            results = {network.lower(): future.result() for network, future in futures.items()}
+
         monitored_apps = {}
-        results = {
-            "applovin": self._fetch_top_for_network("Applovin", base_params, start_str, end_str, monitored_apps),
-            "facebook": self._fetch_top_for_network("Facebook", base_params, start_str, end_str, monitored_apps),
-            "youtube": self._fetch_top_for_network("Youtube", base_params, start_str, end_str, monitored_apps),
-            "monitored_apps": list(monitored_apps.values())
-        }
+        for network in networks:
+            for app_name, app in network_apps[network].items():
+                monitored_apps.setdefault(app_name, app)
+        results["monitored_apps"] = list(monitored_apps.values())
         
         logger.info(f"Successfully retrieved Applovin ({len(results['applovin'])}) and Facebook ({len(results['facebook'])}) real video records.")
         return results
 
+    @retry(
+        stop=stop_after_attempt(4),
+        wait=wait_exponential_jitter(initial=1, max=30),
+        retry=retry_if_exception(_is_transient_request_error),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+    )
+    def _get(self, url: str, params: Dict[str, Any]) -> requests.Response:
+        """GET against Sensor Tower, retrying connection errors, timeouts and 429/5xx responses."""
+        response = self.session.get(url, params=params, timeout=60)
+        if response.status_code in TRANSIENT_STATUS_CODES:
+            response.raise_for_status()
+        return response
+
     def _fetch_top_for_network(self, network_name: str, base_params: Dict[str, Any], start_str: str, end_str: str, monitored_apps: Dict[str, Dict[str, str]] = None) -> List[Dict[str, Any]]:
         top_endpoint = f"{self.base_url}/unified/ad_intel/creatives/top"
         params = base_params.copy()
@@ -139,68 +198,79 @@ class SensorTowerFetcher:
         max_pages = 50 # Allow deep pagination since we are filtering from all categories
         current_page = 1
         
-        while len(target_ads) < 50 and current_page <= max_pages:
-            params["page"] = current_page
-            logger.info(f"Fetching {network_name} Top page {current_page} (Current matching: {len(target_ads)}/50)...")
-            
-            response = requests.get(top_endpoint, params=params)
-            if response.status_code != 200:
-                logger.error(f"SensorTower API Error (/top) for {network_name}: {response.status_code} - {response.text}")
-                break
+        # Keep the next PAGE_PREFETCH pages in flight while the current one is filtered;
+        # pages are still consumed strictly in order, and leftovers are cancelled at the end
+        executor = ThreadPoolExecutor(max_workers=PAGE_PREFETCH)
+        in_flight = {}
+        next_page = 1
+        try:
+            while len(target_ads) < 50 and current_page <= max_pages:
+                while next_page <= max_pages and len(in_flight) < PAGE_PREFETCH:
+                    in_flight[next_page] = executor.submit(self._get, top_endpoint, {**params, "page": next_page})
+                    next_page += 1
+                logger.info(f"Fetching {network_name} Top page {current_page} (Current matching: {len(target_ads)}/50)...")
                 
-            data = response.json()
-            ad_units_top = data.get("ad_units", [])
-            
-            if not ad_units_top:
-                break # No more data available
-            
-            for unit in ad_units_top:
-                if len(target_ads) >= 50:
+                response = in_flight.pop(current_page).result()
+                if response.status_code != 200:
+                    logger.error(f"SensorTower API Error (/top) for {network_name}: {response.status_code} - {response.text}")
                     break
                     
-                app_info = unit.get("app_info", {})
-                app_name = app_info.get("name", "")
-                ad_id = unit.get("id")
+                data = response.json()
+                ad_units_top = data.get("ad_units", [])
                 
-                # Check if this creative belongs to one of our target apps
-                is_target = any(target.lower() in app_name.lower() for target in self.target_apps)
-                company = self._get_company(app_name) if is_target else ""
-                if is_target:
-                    if monitored_apps is not None and app_name not in monitored_apps:
-                        monitored_apps[app_name] = {
-                            "name": app_name,
-                            "icon_url": app_info.get("icon_url", ""),
-                            "company": company,
-                        }
-
-                if is_target and ad_id and ad_id not in seen_ad_ids:
-                    seen_ad_ids.add(ad_id)
-                    
-                    creatives = unit.get("creatives", [])
-                    if not creatives:
-                        continue
+                if not ad_units_top:
+                    break # No more data available
+                
+                for unit in ad_units_top:
+                    if len(target_ads) >= 50:
+                        break
                         
-                    first_creative = creatives[0]
-                    video_url = first_creative.get("creative_url")
+                    app_info = unit.get("app_info", {})
+                    app_name = app_info.get("name", "")
+                    ad_id = unit.get("id")
                     
-                    # Try to get app_id for later share lookup
-                    unified_app_id = app_info.get("app_id") or app_info.get("unified_app_id") or app_info.get("id")
-                    
-                    if video_url:
-                        target_ads.append({
-                            "ad_id": ad_id,
-                            "app_id": unified_app_id,
-                            "app_name": app_name,
-                            "company": company,
-                            "ad_network": network_name,
-                            "first_seen_at": unit.get("first_seen_at", "未知")[:10],
-                            "last_seen_at": unit.get("last_seen_at", "未知")[:10],
-                            "video_url": video_url,
-                            "thumbnail_url": first_creative.get("preview_url") or first_creative.get("thumb_url", ""),
-                            "duration_seconds": first_creative.get("video_duration", 0),
-                            "share": 0  # Default, will be updated via second API call
-                        })
-            current_page += 1
+                    # Check if this creative belongs to one of our target apps
+                    is_target = self._target_re.search(app_name.lower()) is not None
+                    company = self._get_company(app_name) if is_target else ""
+                    if is_target:
+                        if monitored_apps is not None and app_name not in monitored_apps:
+                            monitored_apps[app_name] = {
+                                "name": app_name,
+                                "icon_url": app_info.get("icon_url", ""),
+                                "company": company,
+                            }
+
+                    if is_target and ad_id and ad_id not in seen_ad_ids:
+                        seen_ad_ids.add(ad_id)
+                        
+                        creatives = unit.get("creatives", [])
+                        if not creatives:
+                            continue
+                            
+                        first_creative = creatives[0]
+                        video_url = first_creative.get("creative_url")
+                        
+                        # Try to get app_id for later share lookup
+                        unified_app_id = app_info.get("app_id") or app_info.get("unified_app_id") or app_info.get("id")
+                        
+                        if video_url:
+                            target_ads.append({
+                                "ad_id": ad_id,
+                                "app_id": unified_app_id,
+                                "app_name": app_name,
+                                "company": company,
+                                "ad_network": network_name,
+                                "channel": network_name.lower(),
+                                "first_seen_at": unit.get("first_seen_at", "未知")[:10],
+                                "last_seen_at": unit.get("last_seen_at", "未知")[:10],
+                                "video_url": video_url,
+                                "thumbnail_url": first_creative.get("preview_url") or first_creative.get("thumb_url", ""),
+                                "duration_seconds": first_creative.get("video_duration", 0),
+                                "share": 0  # Default, will be updated via second API call
+                            })
+                current_page += 1
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
             
         # Limit to top 50
         final_top = target_ads[:50]
@@ -246,7 +316,7 @@ class SensorTowerFetcher:
                 
                 while True:
                     share_params["page"] = page
-                    share_resp = requests.get(creatives_endpoint, params=share_params)
+                    share_resp = self._get(creatives_endpoint, share_params)
                     if share_resp.status_code == 200:
                         share_data = share_resp.json()
                         ad_units = share_data.get("ad_units", [])
@@ -298,6 +368,7 @@ class SensorTowerFetcher:
                      "app_name": game_name,
                      "company": self._get_company(game_name),
                      "ad_network": network,
+                     "channel": network.lower(),
                      "first_seen_at": "2026-02-01",
                      "last_seen_at": "2026-02-25",
                      "video_url": f"https://example.com/mock_video_{i}.mp4",
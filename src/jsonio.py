@@ -0,0 +1,24 @@
+import json
+from typing import Any, Union
+
+# orjson is several times faster than the stdlib on our archive/cache payloads;
+# fall back to json so a missing wheel never breaks the weekly run
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any, indent: bool = True) -> bytes:
+    """Serializes obj to UTF-8 JSON bytes (non-ASCII kept as-is, 2-space indent by default)."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    """Parses JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
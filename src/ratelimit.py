@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+from typing import Deque, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SlidingWindowLimiter:
+    """
+    Client-side requests-per-minute / tokens-per-minute limiter for the Gemini API.
+    Callers wait locally before a request would exceed the quota instead of letting
+    the provider reject it with a 429 and paying for the retry round-trip.
+    """
+
+    def __init__(self, rpm: int, tpm: int = 0, window: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._requests: Deque[Tuple[float, int]] = collections.deque()
+        self._tokens: Deque[Tuple[float, int]] = collections.deque()
+        self._tokens_in_window = 0
+        self._blocked_until = 0.0
+        # A thread lock (not asyncio.Lock) keeps the limiter usable across event loops
+        self._lock = threading.Lock()
+
+    async def acquire(self, est_tokens: int = 0) -> None:
+        """Waits until one request of roughly est_tokens fits in the current window."""
+        while True:
+            wait = self._try_reserve(est_tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def __aenter__(self) -> "SlidingWindowLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        return None
+
+    def observe(self, headers: Optional[Mapping[str, str]]) -> None:
+        """
+        Tightens the local window using rate-limit headers reported by the provider.
+        Honors `retry-after`, and pads the window so local headroom never exceeds
+        `x-ratelimit-remaining-requests` / `x-ratelimit-remaining-tokens`.
+        """
+        if not headers:
+            return
+        headers = {k.lower(): v for k, v in headers.items()}
+        retry_after = parse_number(headers.get("retry-after"))
+        remaining_requests = parse_number(headers.get("x-ratelimit-remaining-requests"))
+        remaining_tokens = parse_number(headers.get("x-ratelimit-remaining-tokens"))
+
+        with self._lock:
+            now = time.monotonic()
+            self._evict(now)
+            if retry_after is not None and retry_after > 0:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+                logger.warning(f"Provider asked to back off for {retry_after:.1f}s.")
+            if remaining_requests is not None and self.rpm:
+                missing = self.rpm - int(remaining_requests) - len(self._requests)
+                for _ in range(max(0, missing)):
+                    self._requests.append((now, 1))
+            if remaining_tokens is not None and self.tpm:
+                missing = self.tpm - int(remaining_tokens) - self._tokens_in_window
+                if missing > 0:
+                    self._tokens.append((now, missing))
+                    self._tokens_in_window += missing
+
+    def _try_reserve(self, est_tokens: int) -> float:
+        """Reserves capacity and returns 0, or returns how long to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            self._evict(now)
+
+            waits = []
+            if self.rpm and len(self._requests) >= self.rpm:
+                waits.append(self._requests[0][0] + self.window - now)
+            # An oversized single request is let through once the window is empty
+            if self.tpm and self._tokens and self._tokens_in_window + est_tokens > self.tpm:
+                waits.append(self._tokens[0][0] + self.window - now)
+            if waits:
+                return max(0.05, max(waits))
+
+            self._requests.append((now, 1))
+            if est_tokens:
+                self._tokens.append((now, est_tokens))
+                self._tokens_in_window += est_tokens
+            return 0.0
+
+    def _evict(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._requests and self._requests[0][0] <= cutoff:
+            self._requests.popleft()
+        while self._tokens and self._tokens[0][0] <= cutoff:
+            _, tokens = self._tokens.popleft()
+            self._tokens_in_window -= tokens
+
+
+class TokenBucket:
+    """
+    Token bucket that spreads Gemini requests evenly at `rate` per second, allowing
+    bursts of up to `capacity`. The sliding window alone admits a whole minute's
+    quota at once; the bucket keeps those requests from hitting the provider together.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        # A thread lock (not asyncio.Lock) keeps the bucket usable across event loops
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> None:
+        """Waits until one token is available and takes it; a non-positive rate never waits."""
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._try_take()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    async def __aenter__(self) -> "TokenBucket":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        return None
+
+    def _try_take(self) -> float:
+        """Takes a token and returns 0, or returns how long until the next token is due."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease concurrency gate.
+    `async with controller:` admits at most floor(limit) concurrent calls; record()
+    grows the limit by alpha while the mean latency of the last `window` calls stays
+    within l_target, and multiplies it by beta on slow windows or throttling errors.
+    """
+
+    def __init__(self, c_min: int = 2, c_max: int = 64, alpha: float = 0.5, beta: float = 0.5,
+                 l_target: float = 60.0, window: int = 10, initial: Optional[float] = None):
+        self.c_min = c_min
+        self.c_max = c_max
+        self.alpha = alpha
+        self.beta = beta
+        self.l_target = l_target
+        self.limit = float(initial if initial is not None else c_min)
+        self._latencies: Deque[float] = collections.deque(maxlen=window)
+        self._last_decrease = 0.0
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = collections.deque()
+
+    async def acquire(self) -> None:
+        if self._in_flight < int(self.limit) and not self._waiters:
+            self._in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over right before cancellation; pass it on
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._wake()
+
+    async def __aenter__(self) -> "AIMDController":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    def record(self, latency: float, throttled: bool = False) -> None:
+        """Feeds one completed call into the controller and adjusts the limit."""
+        self._latencies.append(latency)
+        mean_latency = sum(self._latencies) / len(self._latencies)
+        if not throttled and mean_latency <= self.l_target:
+            self.limit = min(self.c_max, self.limit + self.alpha)
+            self._wake()
+            return
+
+        # Decrease at most once per observed round-trip so a burst of concurrent
+        # failures does not collapse the limit straight to c_min
+        now = time.monotonic()
+        if now - self._last_decrease < mean_latency:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.c_min, self.limit * self.beta)
+        reason = "throttled" if throttled else f"mean latency {mean_latency:.1f}s"
+        logger.warning(f"Reducing Gemini concurrency {previous:.1f} -> {self.limit:.1f} ({reason}).")
+
+    def _wake(self) -> None:
+        while self._waiters and self._in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self._in_flight += 1
+            waiter.set_result(None)
+
+
+def parse_number(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(str(value).strip().rstrip("s"))
+    except ValueError:
+        return None
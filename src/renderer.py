@@ -1,20 +1,26 @@
 import os
 import logging
 from datetime import datetime, timedelta
-from jinja2 import Environment, FileSystemLoader
+from functools import lru_cache
+from jinja2 import Environment, FileSystemLoader, Template
 from typing import List, Dict, Any
 
 from src.config import REPORT_OUTPUT_DIR
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
+def _load_template(template_dir: str) -> Template:
+    """Parses and compiles the report template once per template directory for the whole process."""
+    env = Environment(loader=FileSystemLoader(template_dir), auto_reload=False, cache_size=-1)
+    return env.get_template('report_template.html')
+
 class ReportRenderer:
     """Renders the analyzed data into a static HTML report."""
     
     def __init__(self, template_dir: str = 'templates'):
         self.template_dir = template_dir
-        self.env = Environment(loader=FileSystemLoader(self.template_dir))
-        self.template = self.env.get_template('report_template.html')
+        self.template = _load_template(os.path.abspath(template_dir))
 
     def render(self, app_summaries: Dict[str, Dict[str, Any]], applovin_items: List[Dict[str, Any]], facebook_items: List[Dict[str, Any]], youtube_items: List[Dict[str, Any]], monitored_apps: List[Dict[str, str]] = None, output_path: str = None) -> str:
         """
@@ -48,27 +54,30 @@ class ReportRenderer:
             if item.get('rank_trend') == 'new':
                 new_items.append({**item, 'channel_label': 'YouTube'})
 
-        # Render the template
-        html_content = self.template.render(
-            report_date=report_date,
-            app_summaries=app_summaries,
-            applovin_items=applovin_items,
-            facebook_items=facebook_items,
-            youtube_items=youtube_items,
-            monitored_apps=monitored_apps or [],
-            new_items=new_items,
-        )
-        
         # Determine output filename: YYMMDD_weekly_report.html
         if not output_path:
             filename_date = datetime.now().strftime("%y%m%d")
             filename = f"{filename_date}_weekly_report.html"
             output_path = os.path.join(REPORT_OUTPUT_DIR, filename)
         
-        # Write to file
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-            
+        # Stream the template into a temp file instead of building the whole HTML string first;
+        # it only replaces the report once fully written, so a failed render never leaves a partial report
+        tmp_path = output_path + ".tmp"
+        try:
+            self.template.stream(
+                report_date=report_date,
+                app_summaries=app_summaries,
+                applovin_items=applovin_items,
+                facebook_items=facebook_items,
+                youtube_items=youtube_items,
+                monitored_apps=monitored_apps or [],
+                new_items=new_items,
+            ).dump(tmp_path, encoding='utf-8')
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
         logger.info(f"Report successfully generated at: {output_path}")
         return output_path
 
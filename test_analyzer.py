@@ -0,0 +1,224 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from google.genai import errors, types
+
+from src import jsonio
+from src import analyzer as analyzer_module
+from src.analyzer import ErrorClass, VideoAnalyzer, _classify_error
+from src.ratelimit import SlidingWindowLimiter, TokenBucket
+
+
+def make_analyzer(tmp_path, **kwargs) -> VideoAnalyzer:
+    return VideoAnalyzer(use_mock=True, cache_file=str(tmp_path / "analysis_cache.json"), **kwargs)
+
+
+def make_video(n: int, **fields):
+    return {"ad_id": f"AD_{n}", "app_name": "Kingshot", "ad_network": "Applovin",
+            "video_url": f"https://cdn.example.com/{n}.mp4", **fields}
+
+
+def gemini_file(n: int) -> types.File:
+    return types.File(name=f"files/{n}", uri=f"https://generativelanguage.googleapis.com/v1beta/files/{n}", mime_type="video/mp4")
+
+
+def test_batch_requests_build_against_sdk(tmp_path):
+    analyzer = make_analyzer(tmp_path)
+    submitted = {}
+
+    async def create(model, src, config):
+        submitted["src"] = src
+        # Echo the items back in reverse, so the join has to use the ad_id metadata
+        responses = [
+            SimpleNamespace(metadata=request.metadata, error=None, response=f"response for {request.metadata['ad_id']}")
+            for request in reversed(src)
+        ]
+        return SimpleNamespace(
+            name="batches/1",
+            state=SimpleNamespace(name="JOB_STATE_SUCCEEDED"),
+            dest=SimpleNamespace(inlined_responses=responses),
+        )
+
+    analyzer.client = SimpleNamespace(aio=SimpleNamespace(batches=SimpleNamespace(create=create)))
+    videos = [make_video(0), make_video(1), make_video(2)]
+    files = {0: gemini_file(0), 1: None, 2: gemini_file(2)}
+
+    responses = asyncio.run(analyzer._run_video_batch(videos, files))
+
+    assert all(isinstance(request, types.InlinedRequest) for request in submitted["src"])
+    assert [request.metadata for request in submitted["src"]] == [{"ad_id": "AD_0"}, {"ad_id": "AD_2"}]
+    assert responses == {0: "response for AD_0", 2: "response for AD_2"}
+
+
+def write_cache(path, entries):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(jsonio.dumps(entries))
+
+
+def test_seed_entries_stay_out_of_compaction(tmp_path):
+    now = time.time()
+    seed = tmp_path / "2026_W01" / "analysis_cache.json"
+    write_cache(seed, {
+        "https://cdn.example.com/0.mp4": {"analysis": {"hook_design": "reused"}, "cached_at": now - 86400, "ad_id": "AD_0"},
+        "https://cdn.example.com/1.mp4": {"analysis": {"hook_design": "unused"}, "cached_at": now - 86400, "ad_id": "AD_1"},
+        "https://cdn.example.com/2.mp4": {"analysis": {"hook_design": "too old"}, "cached_at": now - 10 * 86400, "ad_id": "AD_2"},
+    })
+    own = tmp_path / "2026_W02" / "analysis_cache.json"
+    own.parent.mkdir()
+    analyzer = VideoAnalyzer(use_mock=True, cache_file=str(own), seed_cache_file=str(seed))
+    assert analyzer._seeded_urls == {"https://cdn.example.com/0.mp4", "https://cdn.example.com/1.mp4"}
+
+    # Found by ad_id even though the CDN URL changed
+    hit = analyzer._lookup_cached(make_video(0, video_url="https://cdn.example.com/0-new.mp4"))
+    assert hit["analysis"] == {"hook_design": "reused"}
+    analyzer.close()
+
+    assert set(jsonio.loads(own.read_bytes())) == {"https://cdn.example.com/0-new.mp4"}
+
+
+def test_legacy_entries_are_aged_by_archive_week(tmp_path):
+    # Bare analyses (no cached_at) from a months-old archive are not reusable, however fresh the file is
+    stale = tmp_path / "2020_W15" / "analysis_cache.json"
+    write_cache(stale, {"https://cdn.example.com/0.mp4": {"hook_design": "stale"}})
+    analyzer = VideoAnalyzer(use_mock=True, cache_file=str(tmp_path / "2020_W16" / "analysis_cache.json"), seed_cache_file=str(stale))
+    assert len(analyzer.analysis_cache) == 0
+
+    year, week, _ = datetime.now().isocalendar()
+    recent = tmp_path / f"{year}_W{week:02d}" / "analysis_cache.json"
+    write_cache(recent, {"https://cdn.example.com/0.mp4": {"hook_design": "recent"}})
+    analyzer = VideoAnalyzer(use_mock=True, cache_file=str(recent))
+    assert analyzer.analysis_cache["https://cdn.example.com/0.mp4"]["analysis"] == {"hook_design": "recent"}
+
+    # Outside an archive week directory there is nothing trustworthy to date them by
+    write_cache(tmp_path / "analysis_cache.json", {"https://cdn.example.com/0.mp4": {"hook_design": "undated"}})
+    assert len(make_analyzer(tmp_path).analysis_cache) == 0
+
+
+def test_journal_replays_over_snapshot_and_skips_torn_line(tmp_path):
+    analyzer = make_analyzer(tmp_path)
+    analyzer._append_cache("https://cdn.example.com/0.mp4", {"hook_design": "first"}, "AD_0")
+    analyzer.close()
+    analyzer = make_analyzer(tmp_path)
+    analyzer._append_cache("https://cdn.example.com/0.mp4", {"hook_design": "second"}, "AD_0")
+    analyzer._append_cache("https://cdn.example.com/1.mp4", {"hook_design": "kept"}, "AD_1")
+    # Simulate a run killed mid-append: the journal ends in a torn line and is never compacted
+    with open(analyzer.cache_journal, 'ab') as f:
+        f.write(b'{"https://cdn.example.com/2.mp4": {"analy')
+
+    analyzer = make_analyzer(tmp_path)
+    assert {url: entry["analysis"] for url, entry in analyzer.analysis_cache.items()} == {
+        "https://cdn.example.com/0.mp4": {"hook_design": "second"},
+        "https://cdn.example.com/1.mp4": {"hook_design": "kept"},
+    }
+    assert analyzer._ad_index == {"AD_0": "https://cdn.example.com/0.mp4", "AD_1": "https://cdn.example.com/1.mp4"}
+
+    # The next append starts on a fresh line, so it survives a further replay
+    analyzer._append_cache("https://cdn.example.com/3.mp4", {"hook_design": "after tear"}, "AD_3")
+    assert "https://cdn.example.com/3.mp4" in make_analyzer(tmp_path).analysis_cache
+
+    analyzer.close()
+    assert not os.path.exists(analyzer.cache_journal)
+    assert len(jsonio.loads((tmp_path / "analysis_cache.json").read_bytes())) == 3
+
+
+def analysis(hook: str) -> dict:
+    return {"hook_design": hook, "emotional_appeal": "", "content_structure": "", "wow_factor": "", "copywriting_features": ""}
+
+
+def test_group_with_wrong_count_falls_back_to_single_calls(tmp_path):
+    analyzer = make_analyzer(tmp_path)
+    analyzer.use_mock = False
+    calls = []
+
+    async def prepare(video_data, session):
+        return gemini_file(video_data["ad_id"])
+
+    async def call_api(models_to_try, contents, config, max_retries=3, est_tokens=0):
+        if config is analyzer._video_group_config:
+            calls.append("group")
+            # Two videos in, one analysis out
+            return SimpleNamespace(parsed=None, text=jsonio.dumps([analysis("merged")]).decode())
+        calls.append(contents[0].name)
+        return SimpleNamespace(parsed=None, text=jsonio.dumps(analysis(f"alone {contents[0].name}")).decode())
+
+    async def delete(name):
+        calls.append(f"delete {name}")
+
+    analyzer._prepare_gemini_file = prepare
+    analyzer._call_api_with_retry = call_api
+    analyzer.client = SimpleNamespace(aio=SimpleNamespace(files=SimpleNamespace(delete=delete)))
+
+    videos = [make_video(0, duration_seconds=20), make_video(1, duration_seconds=30)]
+    results = asyncio.run(analyzer._analyze_video_group(videos, session=None))
+
+    assert calls[0] == "group"
+    assert sorted(calls[1:3]) == ["files/AD_0", "files/AD_1"]
+    assert sorted(calls[3:]) == ["delete files/AD_0", "delete files/AD_1"]
+    assert [result["analysis"]["hook_design"] for result in results] == ["alone files/AD_0", "alone files/AD_1"]
+    assert set(analyzer.analysis_cache) == {video["video_url"] for video in videos}
+
+
+def api_error(code: int) -> errors.APIError:
+    cls = errors.ClientError if code < 500 else errors.ServerError
+    return cls(code, {"error": {"code": code, "message": "test", "status": "TEST"}})
+
+
+def test_classify_error():
+    assert _classify_error(api_error(429)) is ErrorClass.RATE_LIMIT
+    assert _classify_error(api_error(503)) is ErrorClass.TRANSIENT
+    assert _classify_error(api_error(404)) is ErrorClass.NOT_FOUND
+    assert _classify_error(api_error(400)) is ErrorClass.FATAL
+    assert _classify_error(ConnectionError("reset")) is ErrorClass.TRANSIENT
+    assert _classify_error(Exception("models/x is not found")) is ErrorClass.NOT_FOUND
+
+
+def run_with_errors(tmp_path, monkeypatch, outcomes, models=("model-a", "model-b")):
+    """Runs _call_api_with_retry against a fake client that raises or returns outcomes in turn."""
+    monkeypatch.setattr(analyzer_module, "_backoff_delay", lambda attempt: 0)
+    analyzer = make_analyzer(tmp_path, bucket=TokenBucket(rate=0), limiter=SlidingWindowLimiter(rpm=0))
+    outcomes = list(outcomes)
+    calls = []
+
+    async def generate_content(model, contents, config):
+        calls.append(model)
+        outcome = outcomes.pop(0) if outcomes else api_error(500)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    analyzer.client = SimpleNamespace(aio=SimpleNamespace(models=SimpleNamespace(generate_content=generate_content)))
+
+    async def call():
+        return await analyzer._call_api_with_retry(list(models), contents=[], config=analyzer._video_config)
+
+    try:
+        return asyncio.run(call()), calls
+    except Exception:
+        return None, calls
+
+
+def test_rate_limits_and_server_errors_have_separate_budgets(tmp_path, monkeypatch):
+    # Three 503s use up the transient budget, yet 429s are still retried on the same model
+    outcomes = [api_error(503)] * 3 + [api_error(429)] * 5 + ["ok"]
+    response, calls = run_with_errors(tmp_path, monkeypatch, outcomes)
+    assert response == "ok"
+    assert calls == ["model-a"] * 9
+
+    response, calls = run_with_errors(tmp_path, monkeypatch, [api_error(429)] * 6 + ["ok"])
+    assert response == "ok"
+    assert calls == ["model-a"] * 6 + ["model-b"]
+
+    response, calls = run_with_errors(tmp_path, monkeypatch, [api_error(503)] * 10, models=("model-a",))
+    assert response is None
+    assert calls == ["model-a"] * 4
+
+
+def test_not_found_and_fatal_errors_move_to_next_model(tmp_path, monkeypatch):
+    response, calls = run_with_errors(tmp_path, monkeypatch, [api_error(404), "ok"])
+    assert (response, calls) == ("ok", ["model-a", "model-b"])
+
+    response, calls = run_with_errors(tmp_path, monkeypatch, [api_error(400), api_error(400)])
+    assert (response, calls) == (None, ["model-a", "model-b"])
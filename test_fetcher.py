@@ -1,8 +1,10 @@
 import os
 import json
 import logging
+import time
+from types import SimpleNamespace
 from dotenv import load_dotenv
-from src.fetcher import SensorTowerFetcher
+from src.fetcher import PAGE_PREFETCH, SensorTowerFetcher
 
 # Configure basic logging for the test script
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -52,5 +54,47 @@ def test_fetcher():
         logger.error(f"Test Failed with Exception: {e}")
         print("\n[!] Please check your parameters in `src/fetcher.py` (_fetch_real_data).")
 
+def test_mock_fetcher_never_calls_the_api():
+    fetcher = SensorTowerFetcher(use_mock=True)
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("mock fetcher made a network call")
+
+    fetcher.session.get = no_network
+    data = fetcher.fetch_top_50_slg_videos()
+    assert [len(data[network]) for network in ("applovin", "facebook", "youtube")] == [50, 50, 50]
+
+def test_page_prefetch_keeps_order_and_stops_at_last_page():
+    fetcher = SensorTowerFetcher(use_mock=True)
+    last_page = 4
+    requested = []
+
+    def fake_get(url, params):
+        if not url.endswith("/top"):
+            return SimpleNamespace(status_code=500, text="share lookup not under test")
+        page = params["page"]
+        requested.append(page)
+        # Earlier pages answer last, so completion order is the reverse of page order
+        time.sleep(0.01 * (PAGE_PREFETCH - page % PAGE_PREFETCH))
+        units = [] if page > last_page else [
+            {
+                "id": f"ad_{page}_{k}",
+                "app_info": {"name": "Kingshot", "app_id": "app"},
+                "creatives": [{"creative_url": f"https://cdn.example.com/{page}_{k}.mp4"}],
+                "first_seen_at": "2026-01-01T00:00:00Z",
+                "last_seen_at": "2026-01-07T00:00:00Z",
+            }
+            for k in range(5)
+        ]
+        return SimpleNamespace(status_code=200, json=lambda: {"ad_units": units}, text="")
+
+    fetcher._get = fake_get
+    videos = fetcher._fetch_top_for_network("Applovin", {"auth_token": "t"}, "2026-01-01", "2026-01-07")
+
+    assert [video["ad_id"] for video in videos] == [f"ad_{page}_{k}" for page in range(1, last_page + 1) for k in range(5)]
+    assert [video["rank"] for video in videos] == list(range(1, 21))
+    # Only the window past the empty page was ever requested
+    assert max(requested) <= last_page + PAGE_PREFETCH
+
 if __name__ == "__main__":
     test_fetcher()
@@ -0,0 +1,64 @@
+import json
+
+from main import build_rank_index, find_previous_week_archive, load_previous_week_stats, load_rank_index
+from src import jsonio
+
+
+def test_previous_week_across_week_53_year_boundary(tmp_path):
+    # 2020 has 53 ISO weeks, so the week before 2021_W01 is 2020_W53
+    (tmp_path / "2020_W53").mkdir()
+    (tmp_path / "2020_W52").mkdir()
+    assert find_previous_week_archive(2021, 1, archive_root=str(tmp_path)) == "2020_W53"
+
+    # 2021 has 52, so 2022_W01 follows 2021_W52
+    (tmp_path / "2021_W52").mkdir()
+    assert find_previous_week_archive(2022, 1, archive_root=str(tmp_path)) == "2021_W52"
+
+
+def test_previous_week_falls_back_to_latest_older_archive(tmp_path):
+    (tmp_path / "2020_W51").mkdir()
+    (tmp_path / "2020_W52").mkdir()
+    (tmp_path / "2021_W02").mkdir()
+    assert find_previous_week_archive(2021, 1, archive_root=str(tmp_path)) == "2020_W52"
+    assert find_previous_week_archive(2020, 51, archive_root=str(tmp_path)) is None
+    assert find_previous_week_archive(2021, 1, archive_root=str(tmp_path / "missing")) is None
+
+
+RAW_WEEK = {
+    "applovin": [
+        {"ad_id": "AD_1", "rank": 1, "share": "12.50%", "app_name": "Kingshot", "creatives": [{"id": "nested"}]},
+        {"ad_id": "AD_2", "rank": 2, "share": 0.125},
+        {"ad_id": "AD_3", "share": "1.00%"},
+    ],
+    "facebook": [{"ad_id": "AD_4", "rank": 1, "share": "<0.01%"}, {"rank": 2, "share": "3.00%"}],
+    "youtube": [],
+    "monitored_apps": [{"name": "Kingshot", "icon_url": ""}],
+}
+
+
+def stats_via_json_load(path):
+    """The full-load reference: json.load the archive and keep records carrying ad_id and rank."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    ranks, shares = {}, {}
+    for network in ("applovin", "facebook", "youtube"):
+        for video in data.get(network, []):
+            if video.get("ad_id") is not None and video.get("rank") is not None:
+                ranks[video["ad_id"]] = video["rank"]
+                shares[video["ad_id"]] = video.get("share")
+    return ranks, shares
+
+
+def test_previous_week_stats_match_json_load(tmp_path):
+    path = tmp_path / "raw_sensortower_data.json"
+    path.write_bytes(jsonio.dumps(RAW_WEEK))
+    assert load_previous_week_stats(str(path)) == stats_via_json_load(path)
+
+
+def test_rank_index_matches_json_load(tmp_path):
+    raw_path = tmp_path / "raw_sensortower_data.json"
+    raw_path.write_bytes(jsonio.dumps(RAW_WEEK))
+    index_path = tmp_path / "ranks.msgpack"
+    # Records missing ad_id or rank are skipped rather than failing the archive step
+    index_path.write_bytes(build_rank_index(RAW_WEEK))
+    assert load_rank_index(str(index_path)) == stats_via_json_load(raw_path)
@@ -0,0 +1,125 @@
+import asyncio
+
+from src import ratelimit
+from src.ratelimit import AIMDController, SlidingWindowLimiter, TokenBucket
+
+
+class FakeClock:
+    """Stands in for time.monotonic so the limiter wait math is deterministic."""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_aimd_caps_concurrency():
+    async def scenario():
+        controller = AIMDController(c_min=1, c_max=4, initial=2)
+        in_flight = peak = 0
+
+        async def call():
+            nonlocal in_flight, peak
+            async with controller:
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        await asyncio.gather(*(call() for _ in range(8)))
+        return peak, controller._in_flight
+
+    peak, leftover = asyncio.run(scenario())
+    assert peak == 2
+    assert leftover == 0
+
+
+def test_aimd_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        controller = AIMDController(c_min=1, c_max=1, initial=1)
+        await controller.acquire()
+
+        # Cancelled while still queued
+        queued = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert not controller._waiters
+
+        # Cancelled right after the slot was handed over, before it could resume
+        handed_over = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        controller.release()
+        handed_over.cancel()
+        await asyncio.gather(handed_over, return_exceptions=True)
+        assert controller._in_flight == 0
+
+        await asyncio.wait_for(controller.acquire(), timeout=1)
+        return controller._in_flight
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_aimd_decreases_once_per_round_trip(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    controller = AIMDController(c_min=2, c_max=64, beta=0.5, initial=16)
+
+    controller.record(5.0, throttled=True)
+    controller.record(5.0, throttled=True)
+    assert controller.limit == 8
+
+    clock.now += 5.0
+    controller.record(5.0, throttled=True)
+    assert controller.limit == 4
+
+
+def test_sliding_window_waits_for_oldest_request(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    limiter = SlidingWindowLimiter(rpm=2, window=60.0)
+
+    assert limiter._try_reserve(0) == 0
+    clock.now += 10
+    assert limiter._try_reserve(0) == 0
+    clock.now += 5
+    assert limiter._try_reserve(0) == 45.0
+
+    clock.now += 45
+    assert limiter._try_reserve(0) == 0
+
+
+def test_sliding_window_token_budget(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    limiter = SlidingWindowLimiter(rpm=100, tpm=1000, window=60.0)
+
+    assert limiter._try_reserve(800) == 0
+    clock.now += 20
+    assert limiter._try_reserve(300) == 40.0
+    assert limiter._try_reserve(200) == 0
+
+    # Provider-reported back-off blocks every request until it elapses
+    limiter.observe({"Retry-After": "7"})
+    assert limiter._try_reserve(0) == 7.0
+
+
+def test_token_bucket_wait_math(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    bucket = TokenBucket(rate=2.0, capacity=2.0)
+
+    assert bucket._try_take() == 0
+    assert bucket._try_take() == 0
+    assert bucket._try_take() == 0.5
+
+    clock.now += 0.25
+    assert bucket._try_take() == 0.25
+    clock.now += 0.25
+    assert bucket._try_take() == 0
+
+    # Idle time refills only up to capacity
+    clock.now += 100
+    assert [bucket._try_take() for _ in range(3)] == [0, 0, 0.5]
+